@@ -0,0 +1,53 @@
+import schemas, crud_async, auth
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+
+# DB_ASYNC=true のとき main.py が同期版より先に登録するホットなエンドポイント
+# (スレッドプールを使わずイベントループ上で処理する)
+router = APIRouter(include_in_schema=False)
+
+# get group detail
+@router.get("/groups/{group_id}", response_model=schemas.GroupDetail)
+async def read_group_detail(group_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(auth.get_current_user_async)):
+    group = await crud_async.get_group_detail(db, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return group
+
+# purchase item
+@router.post("/shops/{item_id}/purchase")
+async def purchase_item(
+    item_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.User = Depends(auth.get_current_user_async)
+):
+    remaining, message = await crud_async.purchase_item(db=db, user_id=current_user.id, item_id=item_id)
+
+    if remaining is None:
+        raise HTTPException(status_code=400, detail=message)
+
+    return {
+        "message": f"Purchase successful! Remaining points: {remaining}",
+        "current_points": remaining
+    }
+
+# get quest complete
+@router.get("/groups/{group_id}/submissions", response_model=list[schemas.QuestCompletionLog])
+async def get_pending_submissions(
+    group_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.User = Depends(auth.get_current_user_async)
+):
+    if not await crud_async.is_group_host(db, current_user.id, group_id):
+        raise HTTPException(status_code=403, detail="ホストのみ閲覧可能です")
+
+    return await crud_async.get_pending_submissions(db, group_id)
+
+@router.get("/groups/{group_id}/my_submissions", response_model=list[schemas.QuestCompletionLog])
+async def read_my_submissions(
+    group_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.User = Depends(auth.get_current_user_async)
+):
+    return await crud_async.get_my_quest_logs(db, group_id, current_user.id)
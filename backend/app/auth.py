@@ -1,26 +1,56 @@
-import os, hashlib, models, database
+import os, time, hashlib, asyncio, threading, models, schemas, database, cache, metrics
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Annotated
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key_needs_to_be_very_long_and_random")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 PASSWORD_PEPPER = os.getenv("PASSWORD_PEPPER", "D3fqv1t_53c2e7_pe9qe2")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt のコスト。変更するとログイン成功時に新しいコストで再ハッシュされる
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# ハッシュ計算専用のワーカー数と、実行待ちとして受け付ける上限 (超えたら 503 で即時に断る)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# db: リクエストごとに users を引く / claims: トークンのクレームと TTL キャッシュで解決し DB を引かない
+AUTH_MODE = os.getenv("AUTH_MODE", "db")
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+_user_cache = cache.TTLCache(maxsize=4096, ttl=USER_CACHE_TTL)
+_user_changed_at: dict[int, float] = {}
+
+AUTH_CACHE_HITS = metrics.counter("auth_user_cache_hits_total", "Authenticated requests served from the user cache")
+AUTH_CLAIMS_HITS = metrics.counter("auth_user_claims_hits_total", "Authenticated requests served from token claims")
+AUTH_DB_LOOKUPS = metrics.counter("auth_user_db_lookups_total", "Authenticated requests that queried users")
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING)
+
 def get_salted_hash(plain_password: str) -> str:
     salted = plain_password + PASSWORD_PEPPER
     return hashlib.sha256(salted.encode("utf-8")).hexdigest()
 
-def verify_password(plain_password, hashed_password):
+def verify_and_update_password(plain_password, hashed_password):
+    # (一致したか, コストが変わっていれば新しいハッシュ) を返す
     safe_password = get_salted_hash(plain_password)
-    return pwd_context.verify(safe_password, hashed_password)
+    return pwd_context.verify_and_update(safe_password, hashed_password)
 
 def get_password_hash(password):
     if not password or password.isspace():
@@ -28,19 +58,51 @@ def get_password_hash(password):
     safe_password = get_salted_hash(password)
     return pwd_context.hash(safe_password)
 
+async def _run_password_job(func, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        return await asyncio.wrap_future(_hash_executor.submit(func, *args))
+    finally:
+        _hash_slots.release()
+
+async def hash_password(password: str) -> str:
+    return await _run_password_job(get_password_hash, password)
+
 def get_user_by_id(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
-def authenticate_user(db: Session, user_id: int, password: str):
+def _update_password_hash(db: Session, user: models.User, new_hash: str):
+    user.password = new_hash
+    db.commit()
+    db.refresh(user)
+
+async def authenticate_user(db: Session, user_id: int, password: str):
     if not password or password.isspace():
         return False
-    user = get_user_by_id(db, user_id)
+    user = await run_in_threadpool(get_user_by_id, db, user_id)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    verified, new_hash = await _run_password_job(verify_and_update_password, password, user.password)
+    if not verified:
         return False
+    if new_hash:
+        await run_in_threadpool(_update_password_hash, db, user, new_hash)
     return user
 
+def user_claims(user) -> dict:
+    # AUTH_MODE=claims のとき get_current_user が DB を引かずに済むようトークンに載せるユーザー情報
+    return {
+        "sub": str(user.id),
+        "name": user.user_name,
+        "first": user.is_first_login,
+        "iat": int(time.time()),
+    }
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -52,22 +114,64 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(database.get_db)):
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str) -> tuple[int, dict]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id_str: str = payload.get("sub")
         if user_id_str is None:
-            raise credentials_exception
-        user_id = int(user_id_str)
+            raise credentials_exception()
+        return int(user_id_str), payload
     except (JWTError, ValueError):
-        raise credentials_exception
-        
-    user = get_user_by_id(db, user_id=user_id)
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        raise credentials_exception()
+
+def invalidate_user(user_id: int):
+    # ユーザー行を更新したら呼ぶ。これ以前に発行されたトークンのクレームは使わなくなる
+    _user_cache.pop(user_id)
+    _user_changed_at[user_id] = time.time()
+
+def _lookup_without_db(user_id: int, payload: dict) -> schemas.User | None:
+    if AUTH_MODE != "claims":
+        return None
+    user = _user_cache.get(user_id)
+    if user is not None:
+        AUTH_CACHE_HITS.inc()
+        return user
+    if "name" in payload and "first" in payload and payload.get("iat", 0) >= _user_changed_at.get(user_id, 0):
+        AUTH_CLAIMS_HITS.inc()
+        return schemas.User(id=user_id, user_name=payload["name"], is_first_login=payload["first"])
+    return None
+
+def _remember(db_user) -> schemas.User:
+    user = schemas.User.model_validate(db_user)
+    if AUTH_MODE == "claims":
+        _user_cache.set(user.id, user)
+    return user
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(database.get_db)) -> schemas.User:
+    user_id, payload = decode_token(token)
+    user = _lookup_without_db(user_id, payload)
+    if user is not None:
+        return user
+    AUTH_DB_LOOKUPS.inc()
+    db_user = await run_in_threadpool(get_user_by_id, db, user_id)
+    if db_user is None:
+        raise credentials_exception()
+    return _remember(db_user)
+
+async def get_current_user_async(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(database.get_async_db)) -> schemas.User:
+    user_id, payload = decode_token(token)
+    user = _lookup_without_db(user_id, payload)
+    if user is not None:
+        return user
+    AUTH_DB_LOOKUPS.inc()
+    db_user = await db.get(models.User, user_id)
+    if db_user is None:
+        raise credentials_exception()
+    return _remember(db_user)
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""
+インデックス有無による実行計画の比較ベンチマーク
+
+    BENCH_DATABASE_URL=postgresql://postgres:pass@db:5432/homequest_bench python bench_indexes.py
+
+本番DBを汚さないよう、BENCH_DATABASE_URL で指定した空のDBに大量データを投入し、
+purchase_item / submit_quest_completion / get_pending_submissions / is_group_host
+が発行するクエリの EXPLAIN ANALYZE を、models.py のインデックスを外した状態 (before)
+と作成した状態 (after) で出力します。
+"""
+import argparse, os, sys
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    sys.exit("BENCH_DATABASE_URL を指定してください (本番DBは使用しないこと)")
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+
+import models
+from database import Base, engine, SessionLocal
+from sqlalchemy import func, text
+from sqlalchemy.dialects import postgresql
+
+# 計測対象: models.py の __table_args__ で宣言したインデックス
+BENCH_INDEXES = [
+    index
+    for model in (models.UserGroup, models.PurchaseHistory, models.QuestCompletionLog)
+    for index in model.__table_args__
+]
+
+SEED_SQL = [
+    """
+    INSERT INTO users (id, user_name, password, is_first_login)
+    SELECT i, 'user_' || i, 'x', false FROM generate_series(1, :users) AS i
+    """,
+    """
+    INSERT INTO groups (id, group_name, owner_user_id)
+    SELECT i, 'group_' || i, i FROM generate_series(1, :groups) AS i
+    """,
+    # 各ユーザーを2グループに所属させる (user_id, group_id) は一意
+    """
+    INSERT INTO user_groups (user_id, group_id, points, is_host)
+    SELECT u, g, 100000, (u % 10 = 0)
+    FROM generate_series(1, :users) AS u,
+         LATERAL (VALUES (u % :groups + 1), ((u + :groups / 2) % :groups + 1)) AS v(g)
+    """,
+    """
+    INSERT INTO shops (id, group_id, item_name, cost_points, limit_per_user, is_active)
+    SELECT i, i % :groups + 1, 'item_' || i, 10, 5, true FROM generate_series(1, :groups * 5) AS i
+    """,
+    """
+    INSERT INTO quests (id, group_id, quest_name, start_time, end_time, reward_points, recurrence)
+    SELECT i, i % :groups + 1, 'quest_' || i, now() - interval '7 days', now() + interval '7 days', 10, 'one_off'
+    FROM generate_series(1, :groups * 5) AS i
+    """,
+    """
+    INSERT INTO purchase_history (user_id, group_id, shop_item_id, item_name, cost, purchased_at)
+    SELECT i % :users + 1, s.group_id, s.id, s.item_name, 10, now() - (i || ' minutes')::interval
+    FROM generate_series(1, :rows) AS i
+    JOIN shops s ON s.id = i % (:groups * 5) + 1
+    """,
+    """
+    INSERT INTO quest_completion_logs (user_id, quest_id, group_id, status, completed_at)
+    SELECT i % :users + 1, q.id, q.group_id,
+           (ARRAY['approved', 'rejected', 'approved', 'pending'])[i % 4 + 1],
+           now() - (i || ' minutes')::interval
+    FROM generate_series(1, :rows) AS i
+    JOIN quests q ON q.id = i % (:groups * 5) + 1
+    """,
+]
+
+def seed(users: int, groups: int, rows: int):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    params = {"users": users, "groups": groups, "rows": rows}
+    with engine.begin() as conn:
+        for sql in SEED_SQL:
+            conn.execute(text(sql), params)
+        for table in ("users", "groups", "shops", "quests"):
+            conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"))
+        conn.execute(text("ANALYZE"))
+
+def bench_queries(db):
+    user_id, group_id = 42, 43
+    item_id = quest_id = group_id
+    QCL = models.QuestCompletionLog
+    return {
+        "purchase_item (limit count)": db.query(func.count(models.PurchaseHistory.id)).filter(
+            models.PurchaseHistory.user_id == user_id,
+            models.PurchaseHistory.shop_item_id == item_id
+        ).statement,
+        "submit_quest_completion (existing check)": db.query(QCL).filter(
+            QCL.quest_id == quest_id,
+            QCL.user_id == user_id,
+            QCL.status.in_(["pending", "approved"])
+        ).limit(1).statement,
+        "get_pending_submissions": db.query(QCL).filter(
+            QCL.group_id == group_id,
+            QCL.status == "pending"
+        ).statement,
+        "is_group_host": db.query(models.UserGroup).filter(
+            models.UserGroup.user_id == user_id,
+            models.UserGroup.group_id == group_id
+        ).limit(1).statement,
+    }
+
+def explain_all(label: str):
+    print(f"\n========== {label} ==========")
+    with SessionLocal() as db:
+        for name, stmt in bench_queries(db).items():
+            sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            plan = db.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + sql)).scalars().all()
+            print(f"\n--- {name} ---")
+            print("\n".join(plan))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--groups", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=1000000, help="購入履歴・クエストログそれぞれの行数")
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        print("seeding...")
+        seed(args.users, args.groups, args.rows)
+
+    for index in BENCH_INDEXES:
+        index.drop(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    explain_all("before (no composite indexes)")
+
+    for index in BENCH_INDEXES:
+        index.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    explain_all("after")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
-import models, schemas, auth, secrets, os
-from sqlalchemy.orm import Session, joinedload
+import models, schemas, auth, cache, events, secrets, os, base64
+from sqlalchemy import func, and_, or_, case, update, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
 from datetime import datetime, timedelta
-from pathlib import Path
 
 PASSWORD_PEPPER = os.getenv("PASSWORD_PEPPER", "D3fqv1t_53c2e7_pe9qe2")
-UPLOAD_DIR = Path(__file__).resolve().parent / "uploads"
+USERS_PAGE_LIMIT = 100
+HISTORY_PAGE_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+GROUP_INCLUDES = {"shops", "quests", "counts"}
+SHOP_RECENT_PURCHASES = 10
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = auth.get_password_hash(user.password)
+# (user_id, group_id) -> schemas.Membership。0 で無効 (ワーカー間では共有されないので短めに)
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "0"))
+_membership_cache = cache.TTLCache(maxsize=10000, ttl=MEMBERSHIP_CACHE_TTL)
+
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
     db_user = models.User(
         user_name=user.user_name,
         password=hashed_password
@@ -17,22 +26,49 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
-def get_users(db: Session):
-    users = db.query(models.User).all()
-    results = []
-    for user in users:
-        group_ids = (
-            db.query(models.UserGroup.group_id)
-            .filter(models.UserGroup.user_id == user.id)
-            .all()
-        )
-        group_ids = [gid for (gid,) in group_ids]
-        results.append({
-            "id": user.id,
-            "user_name": user.user_name,
-            "groups": group_ids
-        })
-    return results
+def get_users(db: Session, after_id: int | None = None, limit: int = USERS_PAGE_LIMIT):
+    group_ids = func.array_remove(func.array_agg(models.UserGroup.group_id), None)
+    query = (
+        db.query(models.User.id, models.User.user_name, group_ids.label("groups"))
+        .outerjoin(models.UserGroup, models.UserGroup.user_id == models.User.id)
+        .group_by(models.User.id)
+        .order_by(models.User.id)
+    )
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    rows = query.limit(min(limit, USERS_PAGE_LIMIT)).all()
+    return [
+        {"id": row.id, "user_name": row.user_name, "groups": row.groups or []}
+        for row in rows
+    ]
+
+def encode_history_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> tuple[datetime, int]:
+    # 不正な cursor は ValueError (binascii.Error / UnicodeDecodeError も ValueError のサブクラス)
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    timestamp, row_id = raw.split("|")
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def _filter_period(query, timestamp_col, since, until):
+    query = query.filter(timestamp_col.isnot(None))
+    if since is not None:
+        query = query.filter(timestamp_col >= since)
+    if until is not None:
+        query = query.filter(timestamp_col < until)
+    return query
+
+def _paginate_history(query, timestamp_col, id_col, after, limit, since, until):
+    # (timestamp, id) の降順で keyset pagination。since / until も SQL 側で絞り込む
+    query = _filter_period(query, timestamp_col, since, until)
+    if after is not None:
+        query = query.filter(tuple_(timestamp_col, id_col) < tuple_(*after))
+    limit = min(limit, HISTORY_MAX_LIMIT)
+    # 1件多く取得して次ページの有無を判定する
+    rows = query.order_by(timestamp_col.desc(), id_col.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
 
 def create_group(db: Session, group: schemas.GroupCreate, owner_id: int):
     db_group = models.Group(
@@ -50,21 +86,81 @@ def create_group(db: Session, group: schemas.GroupCreate, owner_id: int):
     )
     db.add(owner_link)
     db.commit()
+    invalidate_membership(db_group.id, owner_id)
     db.refresh(owner_link)
     return db_group
 
-def get_groups(db: Session):
-    return db.query(models.Group).all()
+def clear_first_login(db: Session, user_id: int):
+    db.query(models.User).filter(
+        models.User.id == user_id,
+        models.User.is_first_login == True
+    ).update({"is_first_login": False}, synchronize_session=False)
+    db.commit()
+    auth.invalidate_user(user_id)
+
+def _group_summaries(db: Session, query, include: set[str]):
+    # 一覧では id / 名前だけを返し、ネストした一覧や件数は include で指定されたときだけ読み込む
+    if "shops" in include:
+        query = query.options(
+            selectinload(models.Group.shops.and_(models.Shop.is_active == True))
+            .load_only(models.Shop.id, models.Shop.item_name)
+        )
+    if "quests" in include:
+        query = query.options(selectinload(models.Group.quests).load_only(models.Quest.id, models.Quest.quest_name))
+    count_labels = []
+    if "counts" in include:
+        # 件数はグループごとに集計したサブクエリを外部結合して1クエリで取る
+        for label, group_col, criteria in (
+            ("shop_count", models.Shop.group_id, [models.Shop.is_active == True]),
+            ("quest_count", models.Quest.group_id, []),
+            ("member_count", models.UserGroup.group_id, []),
+        ):
+            counts = (
+                db.query(group_col.label("group_id"), func.count().label("n"))
+                .filter(*criteria)
+                .group_by(group_col)
+                .subquery()
+            )
+            query = query.outerjoin(counts, counts.c.group_id == models.Group.id).add_columns(
+                func.coalesce(counts.c.n, 0).label(label)
+            )
+            count_labels.append(label)
+
+    results = []
+    for row in query.order_by(models.Group.id).all():
+        group = row[0] if count_labels else row
+        summary = {"id": group.id, "group_name": group.group_name, "owner_user_id": group.owner_user_id}
+        if "shops" in include:
+            summary["shops"] = [{"id": shop.id, "item_name": shop.item_name} for shop in group.shops]
+        if "quests" in include:
+            summary["quests"] = [{"id": quest.id, "quest_name": quest.quest_name} for quest in group.quests]
+        for label in count_labels:
+            summary[label] = getattr(row, label)
+        results.append(summary)
+    return results
+
+def get_groups(db: Session, include: set[str] = frozenset()):
+    return _group_summaries(db, db.query(models.Group), include)
 
 def add_user_to_group(db: Session, user_id: int, group_id: int):
     user_group = models.UserGroup(user_id=user_id, group_id=group_id)
     db.add(user_group)
     db.commit()
+    invalidate_membership(group_id, user_id)
     db.refresh(user_group)
     return user_group
 
 def get_group_detail(db: Session, group_id: int):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    group = (
+        db.query(models.Group)
+        .options(
+            selectinload(models.Group.members).joinedload(models.UserGroup.user),
+            selectinload(models.Group.shops.and_(models.Shop.is_active == True)),
+            selectinload(models.Group.quests)
+        )
+        .filter(models.Group.id == group_id)
+        .first()
+    )
     if not group:
         return None
 
@@ -93,7 +189,7 @@ def get_group_detail(db: Session, group_id: int):
         "invite_code": group.invite_code,
         "users": users_data,
         "hosts": hosts_data,
-        "shops": [shop for shop in group.shops if shop.is_active],
+        "shops": group.shops,
         "quests": group.quests
     }
     
@@ -126,25 +222,41 @@ def create_shop_item(db: Session, shop_item: schemas.ShopCreate, group_id: int):
     return db_item
 
 def purchase_item(db: Session, user_id: int, item_id: int):
+    # 残高チェックと減算を1つの条件付き UPDATE で行うので、同時購入でもロックなしで残高が正しく保たれる
     shop_item = db.query(models.Shop).filter(models.Shop.id == item_id,models.Shop.is_active == True).first()
     if not shop_item:
         return None, "Item not found"
-    if shop_item.limit_per_user is not None:
-        count = db.query(models.PurchaseHistory).filter(
-            models.PurchaseHistory.user_id == user_id,
-            models.PurchaseHistory.shop_item_id == item_id
-        ).count()
-        if count >= shop_item.limit_per_user:
-            return None, f"Purchase limit reached (Max: {shop_item.limit_per_user})"
-    user_group = db.query(models.UserGroup).filter(
-        models.UserGroup.user_id == user_id,
-        models.UserGroup.group_id == shop_item.group_id
-    ).first()
-    if not user_group:
-        return None, "User not in group"
-    if user_group.points < shop_item.cost_points:
+    limit = shop_item.limit_per_user
+    if limit is not None:
+        counter = models.PurchaseCounter
+        bumped = db.execute(
+            pg_insert(counter)
+            .values(user_id=user_id, shop_item_id=item_id, purchase_count=1)
+            .on_conflict_do_update(
+                index_elements=[counter.user_id, counter.shop_item_id],
+                set_={"purchase_count": counter.purchase_count + 1},
+                where=counter.purchase_count < limit
+            )
+            .returning(counter.purchase_count)
+        ).scalar()
+        if bumped is None or bumped > limit:
+            db.rollback()
+            return None, f"Purchase limit reached (Max: {limit})"
+    remaining = db.execute(
+        update(models.UserGroup)
+        .where(
+            models.UserGroup.user_id == user_id,
+            models.UserGroup.group_id == shop_item.group_id,
+            models.UserGroup.points >= shop_item.cost_points
+        )
+        .values(points=models.UserGroup.points - shop_item.cost_points)
+        .returning(models.UserGroup.points)
+    ).scalar()
+    if remaining is None:
+        db.rollback()
+        if not get_membership(db, user_id, shop_item.group_id).is_member:
+            return None, "User not in group"
         return None, "Not enough points"
-    user_group.points -= shop_item.cost_points
     history = models.PurchaseHistory(
         user_id=user_id,
         group_id=shop_item.group_id,
@@ -153,26 +265,149 @@ def purchase_item(db: Session, user_id: int, item_id: int):
         cost=shop_item.cost_points
     )
     db.add(history)
+    db.flush()
+    db.add(models.PointsLedger(
+        user_id=user_id,
+        group_id=shop_item.group_id,
+        delta=-shop_item.cost_points,
+        balance_after=remaining,
+        reason="purchase",
+        ref_id=history.id
+    ))
+    events.emit(db, shop_item.group_id, "purchase", user_id=user_id, shop_item_id=shop_item.id, purchase_id=history.id)
+    events.emit(db, shop_item.group_id, "points_changed", user_id=user_id, points=remaining)
     db.commit()
-    db.refresh(user_group)
-    return user_group, "Success"
+    return remaining, "Success"
 
-def get_user_purchases(db: Session, user_id: int):
-    return db.query(models.PurchaseHistory).filter(
+def backfill_purchase_counters(db: Session):
+    # purchase_counters 導入前の購入履歴からカウンターを作る (起動時にテーブルを新規作成した場合のみ)
+    db.execute(text(
+        "INSERT INTO purchase_counters (user_id, shop_item_id, purchase_count) "
+        "SELECT user_id, shop_item_id, count(*) FROM purchase_history "
+        "WHERE user_id IS NOT NULL AND shop_item_id IS NOT NULL "
+        "GROUP BY user_id, shop_item_id "
+        "ON CONFLICT DO NOTHING"
+    ))
+    db.commit()
+
+def get_shop_overview(db: Session, user_id: int, recent_limit: int = SHOP_RECENT_PURCHASES):
+    # ショップ画面用に、参加中の全グループ分の残高・商品・残り購入回数・自分の購入履歴を3クエリで取得する
+    memberships = (
+        db.query(models.Group, models.UserGroup.is_host, models.UserGroup.points)
+        .join(models.UserGroup, models.UserGroup.group_id == models.Group.id)
+        .filter(models.UserGroup.user_id == user_id)
+        .order_by(models.Group.id)
+        .all()
+    )
+    groups = {}
+    for group, is_host, points in memberships:
+        is_owner = group.owner_user_id == user_id
+        groups[group.id] = {
+            "id": group.id,
+            "group_name": group.group_name,
+            "owner_user_id": group.owner_user_id,
+            "is_host": bool(is_host) or is_owner,
+            "is_owner": is_owner,
+            "points": points or 0,
+            "items": [],
+            "recent_purchases": [],
+        }
+    if not groups:
+        return {"groups": []}
+
+    # 残り購入回数は purchase_counters から計算する (上限なしの商品は None)
+    counter = models.PurchaseCounter
+    purchased = func.coalesce(counter.purchase_count, 0)
+    remaining = case(
+        (models.Shop.limit_per_user.isnot(None), func.greatest(models.Shop.limit_per_user - purchased, 0)),
+        else_=None
+    )
+    item_rows = (
+        db.query(models.Shop, remaining.label("remaining"))
+        .outerjoin(counter, and_(counter.shop_item_id == models.Shop.id, counter.user_id == user_id))
+        .filter(models.Shop.group_id.in_(list(groups)), models.Shop.is_active == True)
+        .order_by(models.Shop.group_id, models.Shop.id)
+        .all()
+    )
+    for item, remaining_count in item_rows:
+        shop_item = schemas.ShopOverviewItem.model_validate(item)
+        shop_item.remaining_purchases = remaining_count
+        groups[item.group_id]["items"].append(shop_item)
+
+    # グループごとに直近 recent_limit 件だけを返す
+    history = models.PurchaseHistory
+    ranked = (
+        db.query(
+            history.id, history.user_id, history.group_id, history.item_name, history.cost, history.purchased_at,
+            func.row_number().over(
+                partition_by=history.group_id,
+                order_by=(history.purchased_at.desc(), history.id.desc())
+            ).label("rank")
+        )
+        .filter(history.user_id == user_id, history.group_id.in_(list(groups)))
+        .subquery()
+    )
+    recent_rows = (
+        db.query(ranked, models.User.user_name)
+        .join(models.User, models.User.id == ranked.c.user_id)
+        .filter(ranked.c.rank <= recent_limit)
+        .order_by(ranked.c.group_id, ranked.c.rank)
+        .all()
+    )
+    for row in recent_rows:
+        groups[row.group_id]["recent_purchases"].append({
+            "id": row.id,
+            "user_name": row.user_name,
+            "item_name": row.item_name,
+            "cost": row.cost,
+            "purchased_at": row.purchased_at
+        })
+    return {"groups": list(groups.values())}
+
+def _purchase_log_page(query, after, limit, since, until):
+    rows, has_more = _paginate_history(
+        query, models.PurchaseHistory.purchased_at, models.PurchaseHistory.id,
+        after, limit, since, until
+    )
+    items = [
+        {
+            "id": hist.id,
+            "user_name": user_name,
+            "item_name": hist.item_name,
+            "cost": hist.cost,
+            "purchased_at": hist.purchased_at
+        }
+        for hist, user_name in rows
+    ]
+    next_cursor = encode_history_cursor(rows[-1][0].purchased_at, rows[-1][0].id) if has_more else None
+    return {"items": items, "next_cursor": next_cursor}
+
+def get_user_purchases(
+    db: Session, user_id: int, after: tuple[datetime, int] | None = None,
+    limit: int = HISTORY_PAGE_LIMIT, since: datetime | None = None, until: datetime | None = None
+):
+    query = db.query(models.PurchaseHistory, models.User.user_name).join(models.User).filter(
         models.PurchaseHistory.user_id == user_id
-    ).order_by(models.PurchaseHistory.purchased_at.desc()).all()
+    )
+    return _purchase_log_page(query, after, limit, since, until)
     
-def submit_quest_completion(db: Session, user_id: int, quest_id: int, proof_path: str):
+def get_submittable_quest(db: Session, user_id: int, quest_id: int):
     quest = db.query(models.Quest).filter(models.Quest.id == quest_id).first()
     if not quest:
-        return False, "Quest not found"
+        return None, "Quest not found"
     existing = db.query(models.QuestCompletionLog).filter(
         models.QuestCompletionLog.quest_id == quest_id,
         models.QuestCompletionLog.user_id == user_id,
         models.QuestCompletionLog.status.in_(["pending", "approved"])
     ).first()
     if existing:
-        return False, "Already submitted or approved"
+        return None, "Already submitted or approved"
+    return quest, "OK"
+
+def submit_quest_completion(db: Session, user_id: int, quest_id: int, proof_path: str):
+    quest, message = get_submittable_quest(db, user_id, quest_id)
+    if not quest:
+        return False, message
     db_log = models.QuestCompletionLog(
         user_id=user_id,
         quest_id=quest_id,
@@ -182,9 +417,25 @@ def submit_quest_completion(db: Session, user_id: int, quest_id: int, proof_path
         completed_at=datetime.now()
     )
     db.add(db_log)
+    db.flush()
+    events.emit(db, quest.group_id, "submission_created", log_id=db_log.id, user_id=user_id, quest_id=quest_id)
     db.commit()
     db.refresh(db_log)
-    return True, "Submission received"
+    return db_log, "Submission received"
+
+def set_processed_proof_image(db: Session, log_id: int, original_path: str, proof_path: str, thumbnail_path: str) -> bool:
+    # 審査前 (元画像のパスのまま) のログだけを差し替える
+    updated = db.query(models.QuestCompletionLog).filter(
+        models.QuestCompletionLog.id == log_id,
+        models.QuestCompletionLog.proof_image_path == original_path
+    ).update(
+        {"proof_image_path": proof_path, "thumbnail_path": thumbnail_path},
+        synchronize_session=False
+    )
+    # 処理中に審査済みになった場合は変換結果の方が不要
+    delete_files_later(db, [original_path] if updated else [proof_path, thumbnail_path])
+    db.commit()
+    return updated > 0
 
 def get_pending_submissions(db: Session, group_id: int):
     logs = db.query(models.QuestCompletionLog).options(
@@ -215,27 +466,34 @@ def review_quest_submission(db: Session, log_id: int, approved: bool):
         return False, "Submission not found"
     if approved:
         log.status = "approved"
-        user_group = (
-            db.query(models.UserGroup)
-            .filter(
-                models.UserGroup.user_id == log.user_id,
-                models.UserGroup.group_id == log.group_id
-            )
-            .first()
-        )
-        if user_group and log.quest and hasattr(user_group, "points"):
-            user_group.points = (user_group.points or 0) + log.quest.reward_points
+        if log.quest:
+            reward = log.quest.reward_points
+            balance = db.execute(
+                update(models.UserGroup)
+                .where(
+                    models.UserGroup.user_id == log.user_id,
+                    models.UserGroup.group_id == log.group_id
+                )
+                .values(points=func.coalesce(models.UserGroup.points, 0) + reward)
+                .returning(models.UserGroup.points)
+            ).scalar()
+            if balance is not None:
+                db.add(models.PointsLedger(
+                    user_id=log.user_id,
+                    group_id=log.group_id,
+                    delta=reward,
+                    balance_after=balance,
+                    reason="quest_reward",
+                    ref_id=log.id
+                ))
+                events.emit(db, log.group_id, "points_changed", user_id=log.user_id, points=balance)
     else:
         log.status = "rejected"
-    if log.proof_image_path:
-        try:
-            filename = Path(log.proof_image_path).name
-            image_path = UPLOAD_DIR / filename
-            if image_path.exists():
-                image_path.unlink()
-            log.proof_image_path = None
-        except Exception as e:
-            print(f"[WARN] Failed to delete image: {e}")
+    # ファイルの削除はコミット後にワーカーが行う (リクエスト内では DB の更新だけ)
+    delete_files_later(db, [log.proof_image_path, log.thumbnail_path])
+    log.proof_image_path = None
+    log.thumbnail_path = None
+    events.emit(db, log.group_id, "submission_reviewed", log_id=log.id, user_id=log.user_id, status=log.status)
     db.commit()
     db.refresh(log)
     return True, "Reviewed successfully"
@@ -244,35 +502,159 @@ def get_my_quest_logs(db: Session, group_id: int, user_id: int):
         models.QuestCompletionLog.group_id == group_id,
         models.QuestCompletionLog.user_id == user_id
     ).all()
-def get_group_purchase_history(db: Session, group_id: int):
-    results = db.query(models.PurchaseHistory, models.User).join(models.User).filter(
-        models.PurchaseHistory.group_id == group_id
-    ).order_by(models.PurchaseHistory.purchased_at.desc()).all()
-    logs = []
-    for hist, user in results:
-        logs.append({
-            "id": hist.id,
-            "user_name": user.user_name,
-            "item_name": hist.item_name,
-            "cost": hist.cost,
-            "purchased_at": hist.purchased_at
-        })
-    return logs
-
-def get_group_quest_history(db: Session, group_id: int):
-    results = db.query(models.QuestCompletionLog, models.User, models.Quest).join(models.User).join(models.Quest).filter(
-        models.QuestCompletionLog.group_id == group_id
-    ).order_by(models.QuestCompletionLog.completed_at.desc()).all()
-    logs = []
-    for comp, user, quest in results:
-        logs.append({
-            "id": comp.id,
-            "user_name": user.user_name,
-            "quest_name": quest.quest_name,
-            "reward_points": quest.reward_points,
-            "completed_at": comp.completed_at
+
+def get_quest_board(db: Session, user_id: int):
+    # クエストボード用に、参加中の全グループ分をグループ数によらず4クエリでまとめて取得する
+    memberships = (
+        db.query(models.Group, models.UserGroup.is_host)
+        .join(models.UserGroup, models.UserGroup.group_id == models.Group.id)
+        .filter(models.UserGroup.user_id == user_id)
+        .order_by(models.Group.id)
+        .all()
+    )
+    groups = []
+    for group, is_host in memberships:
+        is_owner = group.owner_user_id == user_id
+        groups.append({
+            "id": group.id,
+            "group_name": group.group_name,
+            "owner_user_id": group.owner_user_id,
+            "is_host": bool(is_host) or is_owner,
+            "is_owner": is_owner,
         })
-    return logs
+    group_ids = [g["id"] for g in groups]
+    host_group_ids = [g["id"] for g in groups if g["is_host"]]
+    if not group_ids:
+        return {"groups": [], "active_quests": [], "my_submissions": [], "pending_reviews": []}
+
+    # 公開期間中 (start_time <= now <= end_time、未設定は無制限) のクエストだけを返す
+    now = datetime.now()
+    active_quests = (
+        db.query(models.Quest)
+        .filter(
+            models.Quest.group_id.in_(group_ids),
+            or_(models.Quest.start_time.is_(None), models.Quest.start_time <= now),
+            or_(models.Quest.end_time.is_(None), models.Quest.end_time >= now)
+        )
+        .order_by(models.Quest.group_id, models.Quest.id)
+        .all()
+    )
+
+    my_submissions = []
+    submission_rows = (
+        db.query(models.QuestCompletionLog, models.Quest.quest_name, models.Quest.reward_points)
+        .outerjoin(models.Quest, models.Quest.id == models.QuestCompletionLog.quest_id)
+        .filter(
+            models.QuestCompletionLog.user_id == user_id,
+            models.QuestCompletionLog.group_id.in_(group_ids),
+            models.QuestCompletionLog.status.in_(["pending", "approved"])
+        )
+        .order_by(models.QuestCompletionLog.completed_at.desc(), models.QuestCompletionLog.id.desc())
+        .all()
+    )
+    for log, quest_name, reward_points in submission_rows:
+        item = schemas.QuestBoardSubmission.model_validate(log)
+        item.quest_title = quest_name
+        item.reward_points = reward_points
+        my_submissions.append(item)
+
+    pending_reviews = []
+    if host_group_ids:
+        pending_rows = (
+            _quest_log_query(db)
+            .filter(
+                models.QuestCompletionLog.group_id.in_(host_group_ids),
+                models.QuestCompletionLog.status == "pending"
+            )
+            .order_by(models.QuestCompletionLog.completed_at, models.QuestCompletionLog.id)
+            .all()
+        )
+        for log, user_name, quest_name in pending_rows:
+            item = schemas.QuestCompletionLog.model_validate(log)
+            item.user_name = user_name
+            item.quest_title = quest_name
+            pending_reviews.append(item)
+
+    return {
+        "groups": groups,
+        "active_quests": active_quests,
+        "my_submissions": my_submissions,
+        "pending_reviews": pending_reviews,
+    }
+def get_group_purchase_history(
+    db: Session, group_id: int, after: tuple[datetime, int] | None = None,
+    limit: int = HISTORY_PAGE_LIMIT, since: datetime | None = None, until: datetime | None = None
+):
+    query = db.query(models.PurchaseHistory, models.User.user_name).join(models.User).filter(
+        models.PurchaseHistory.group_id == group_id
+    )
+    return _purchase_log_page(query, after, limit, since, until)
+
+def iter_group_purchase_history(
+    db: Session, group_id: int, since: datetime | None = None, until: datetime | None = None, batch_size: int = 1000
+):
+    # エクスポート用。ORM オブジェクトを作らず、サーバーサイドカーソルから batch_size 件ずつ読む
+    query = db.query(
+        models.PurchaseHistory.id,
+        models.User.user_name,
+        models.PurchaseHistory.item_name,
+        models.PurchaseHistory.cost,
+        models.PurchaseHistory.purchased_at
+    ).join(models.User).filter(models.PurchaseHistory.group_id == group_id)
+    query = _filter_period(query, models.PurchaseHistory.purchased_at, since, until)
+    query = query.order_by(models.PurchaseHistory.purchased_at.desc(), models.PurchaseHistory.id.desc())
+    for row in query.yield_per(batch_size):
+        yield row._asdict()
+
+def iter_group_quest_history(
+    db: Session, group_id: int, since: datetime | None = None, until: datetime | None = None, batch_size: int = 1000
+):
+    query = (
+        db.query(
+            models.QuestCompletionLog.id,
+            models.QuestCompletionLog.user_id,
+            models.User.user_name,
+            models.QuestCompletionLog.quest_id,
+            models.Quest.quest_name.label("quest_title"),
+            models.QuestCompletionLog.status,
+            models.QuestCompletionLog.completed_at
+        )
+        .outerjoin(models.User, models.User.id == models.QuestCompletionLog.user_id)
+        .outerjoin(models.Quest, models.Quest.id == models.QuestCompletionLog.quest_id)
+        .filter(models.QuestCompletionLog.group_id == group_id)
+    )
+    query = _filter_period(query, models.QuestCompletionLog.completed_at, since, until)
+    query = query.order_by(models.QuestCompletionLog.completed_at.desc(), models.QuestCompletionLog.id.desc())
+    for row in query.yield_per(batch_size):
+        yield row._asdict()
+
+def _quest_log_page(query, after, limit, since, until):
+    rows, has_more = _paginate_history(
+        query, models.QuestCompletionLog.completed_at, models.QuestCompletionLog.id,
+        after, limit, since, until
+    )
+    items = []
+    for log, user_name, quest_name in rows:
+        item = schemas.QuestCompletionLog.model_validate(log)
+        item.user_name = user_name
+        item.quest_title = quest_name
+        items.append(item)
+    next_cursor = encode_history_cursor(rows[-1][0].completed_at, rows[-1][0].id) if has_more else None
+    return {"items": items, "next_cursor": next_cursor}
+
+def _quest_log_query(db: Session):
+    return (
+        db.query(models.QuestCompletionLog, models.User.user_name, models.Quest.quest_name)
+        .outerjoin(models.User, models.User.id == models.QuestCompletionLog.user_id)
+        .outerjoin(models.Quest, models.Quest.id == models.QuestCompletionLog.quest_id)
+    )
+
+def get_group_quest_history(
+    db: Session, group_id: int, after: tuple[datetime, int] | None = None,
+    limit: int = HISTORY_PAGE_LIMIT, since: datetime | None = None, until: datetime | None = None
+):
+    query = _quest_log_query(db).filter(models.QuestCompletionLog.group_id == group_id)
+    return _quest_log_page(query, after, limit, since, until)
 
 def create_invite_code(db: Session, group_id: int):
     group = db.query(models.Group).filter(models.Group.id == group_id).first()
@@ -306,9 +688,34 @@ def join_group_by_code(db: Session, user_id: int, invite_code: str):
         is_host=False
     )
     db.add(new_member)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # 同時に参加した (ダブルクリックなど) 場合は ux_user_groups_user_group で弾かれる
+        db.rollback()
+        return group, "すでにこのグループに参加しています"
+    invalidate_membership(group.id, user_id)
     return group, "成功"
 
+def dedupe_memberships(db: Session):
+    # 一意インデックス導入前に check-then-insert の競合で重複した (user_id, group_id) を1行にまとめる
+    # 最も古い行を残し、どれかの行がホストならホスト権限を引き継ぐ
+    keep_ids = (
+        "SELECT min(id) FROM user_groups WHERE user_id IS NOT NULL AND group_id IS NOT NULL "
+        "GROUP BY user_id, group_id"
+    )
+    db.execute(text(
+        f"UPDATE user_groups SET is_host = true WHERE id IN ({keep_ids} "
+        "HAVING count(*) > 1 AND max(CASE WHEN is_host THEN 1 ELSE 0 END) = 1)"
+    ))
+    removed = db.execute(text(
+        "DELETE FROM user_groups WHERE user_id IS NOT NULL AND group_id IS NOT NULL "
+        f"AND id NOT IN ({keep_ids})"
+    )).rowcount
+    db.commit()
+    if removed:
+        print(f"[INFO] Removed {removed} duplicate membership row(s)")
+
 def regenerate_invite_code(db: Session, group_id: int):
     group = db.query(models.Group).filter(models.Group.id == group_id).first()
     if not group:
@@ -322,12 +729,42 @@ def regenerate_invite_code(db: Session, group_id: int):
     db.refresh(group)
     return group.invite_code
 
+def get_membership(db: Session, user_id: int, group_id: int) -> schemas.Membership:
+    key = (user_id, group_id)
+    if MEMBERSHIP_CACHE_TTL > 0:
+        cached = _membership_cache.get(key)
+        if cached is not None:
+            return cached
+    # グループのオーナーと呼び出し元の UserGroup 行を1クエリで取得する
+    row = (
+        db.query(models.Group.owner_user_id, models.UserGroup.id, models.UserGroup.is_host)
+        .outerjoin(models.UserGroup, and_(
+            models.UserGroup.group_id == models.Group.id,
+            models.UserGroup.user_id == user_id
+        ))
+        .filter(models.Group.id == group_id)
+        .first()
+    )
+    membership = schemas.Membership(
+        user_id=user_id,
+        group_id=group_id,
+        group_exists=row is not None,
+        is_member=row is not None and row.id is not None,
+        is_host=bool(row and row.is_host),
+        is_owner=row is not None and row.owner_user_id == user_id,
+    )
+    if MEMBERSHIP_CACHE_TTL > 0:
+        _membership_cache.set(key, membership)
+    return membership
+
+def invalidate_membership(group_id: int, user_id: int | None = None):
+    if user_id is None:
+        _membership_cache.pop_where(lambda key: key[1] == group_id)
+    else:
+        _membership_cache.pop((user_id, group_id))
+
 def is_group_host(db: Session, user_id: int, group_id: int) -> bool:
-    user_group = db.query(models.UserGroup).filter(
-        models.UserGroup.user_id == user_id,
-        models.UserGroup.group_id == group_id
-    ).first()
-    return user_group.is_host if user_group else False
+    return get_membership(db, user_id, group_id).is_host
 
 def get_quest(db: Session, quest_id: int):
     return db.query(models.Quest).filter(models.Quest.id == quest_id).first()
@@ -335,6 +772,7 @@ def get_quest(db: Session, quest_id: int):
 def delete_quest(db: Session, quest_id: int):
     quest = get_quest(db, quest_id)
     if quest:
+        release_log_images(db, models.QuestCompletionLog.quest_id == quest_id)
         db.delete(quest)
         db.commit()
         return True
@@ -355,8 +793,7 @@ def delete_shop_item(db: Session, item_id: int):
     return False
 
 def is_group_owner(db: Session, user_id: int, group_id: int) -> bool:
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
-    return group and group.owner_user_id == user_id
+    return get_membership(db, user_id, group_id).is_owner
 
 def update_member_host_status(db: Session, group_id: int, user_id: int, is_host: bool):
     member = db.query(models.UserGroup).filter(
@@ -366,6 +803,7 @@ def update_member_host_status(db: Session, group_id: int, user_id: int, is_host:
     if member:
         member.is_host = is_host
         db.commit()
+        invalidate_membership(group_id, user_id)
         db.refresh(member)
         return member
     return None
@@ -376,18 +814,74 @@ def remove_member(db: Session, group_id: int, user_id: int):
         models.UserGroup.user_id == user_id
     ).first()
     if member:
+        close_points_balance(db, member)
         db.delete(member)
         db.commit()
+        invalidate_membership(group_id, user_id)
         return True
     return False
 
-def get_user_joined_groups(db: Session, user_id: int):
+def close_points_balance(db: Session, member: models.UserGroup):
+    # 脱退・追放時に台帳の合計を 0 に戻しておく (再参加時の残高 0 と整合させる)
+    if member.points:
+        db.add(models.PointsLedger(
+            user_id=member.user_id,
+            group_id=member.group_id,
+            delta=-member.points,
+            balance_after=0,
+            reason="membership_closed"
+        ))
+        events.emit(db, member.group_id, "points_changed", user_id=member.user_id, points=0)
+
+def get_points_ledger(db: Session, group_id: int, user_id: int, since: datetime | None = None, until: datetime | None = None):
+    query = db.query(models.PointsLedger).filter(
+        models.PointsLedger.user_id == user_id,
+        models.PointsLedger.group_id == group_id
+    )
+    if since is not None:
+        query = query.filter(models.PointsLedger.created_at >= since)
+    if until is not None:
+        query = query.filter(models.PointsLedger.created_at < until)
+    return query.order_by(models.PointsLedger.created_at, models.PointsLedger.id).all()
+
+def backfill_points_ledger(db: Session):
+    # points_ledger 導入前の残高を opening_balance として記帳する (起動時にテーブルを新規作成した場合のみ)
+    db.execute(text(
+        "INSERT INTO points_ledger (user_id, group_id, delta, balance_after, reason, created_at) "
+        "SELECT user_id, group_id, points, points, 'opening_balance', now() FROM user_groups "
+        "WHERE user_id IS NOT NULL AND group_id IS NOT NULL AND coalesce(points, 0) <> 0"
+    ))
+    db.commit()
+
+def find_points_mismatches(db: Session):
+    # 実体化された残高 (UserGroup.points) と台帳の合計が食い違っているメンバーを返す
+    ledger = (
+        db.query(
+            models.PointsLedger.user_id,
+            models.PointsLedger.group_id,
+            func.sum(models.PointsLedger.delta).label("total")
+        )
+        .group_by(models.PointsLedger.user_id, models.PointsLedger.group_id)
+        .subquery()
+    )
+    ledger_total = func.coalesce(ledger.c.total, 0)
     return (
+        db.query(models.UserGroup, ledger_total.label("ledger_total"))
+        .outerjoin(ledger, and_(
+            ledger.c.user_id == models.UserGroup.user_id,
+            ledger.c.group_id == models.UserGroup.group_id
+        ))
+        .filter(func.coalesce(models.UserGroup.points, 0) != ledger_total)
+        .all()
+    )
+
+def get_user_joined_groups(db: Session, user_id: int, include: set[str] = frozenset()):
+    query = (
         db.query(models.Group)
         .join(models.UserGroup, models.Group.id == models.UserGroup.group_id)
         .filter(models.UserGroup.user_id == user_id)
-        .all()
     )
+    return _group_summaries(db, query, include)
     
 def leave_group(db: Session, group_id: int, user_id: int) -> bool:
     link = db.query(models.UserGroup).filter(
@@ -395,23 +889,80 @@ def leave_group(db: Session, group_id: int, user_id: int) -> bool:
         models.UserGroup.user_id == user_id
     ).first()
     if link:
+        close_points_balance(db, link)
         db.delete(link)
         db.commit()
+        invalidate_membership(group_id, user_id)
         return True
     return False
 
 def delete_group(db: Session, group_id: int) -> bool:
     group = db.query(models.Group).filter(models.Group.id == group_id).first()
     if group:
+        release_log_images(db, models.QuestCompletionLog.group_id == group_id)
         db.delete(group)
         db.commit()
+        invalidate_membership(group_id)
         return True
     return False
     # プレイヤーが自分の「すべてのグループ」でのクエスト履歴を確認する用
-def get_user_quest_history_all(db: Session, user_id: int):
-    return db.query(models.QuestCompletionLog).options(
-        joinedload(models.QuestCompletionLog.quest),
-        joinedload(models.QuestCompletionLog.group)
+def get_user_quest_history_all(
+    db: Session, user_id: int, after: tuple[datetime, int] | None = None,
+    limit: int = HISTORY_PAGE_LIMIT, since: datetime | None = None, until: datetime | None = None
+):
+    query = _quest_log_query(db).filter(models.QuestCompletionLog.user_id == user_id)
+    return _quest_log_page(query, after, limit, since, until)
+
+def enqueue_job(db: Session, kind: str, **payload):
+    # 呼び出し元と同じトランザクションで登録するので、ロールバックされた変更のジョブは実行されない
+    db.add(models.Job(kind=kind, payload=payload))
+
+def delete_files_later(db: Session, paths: list[str | None]):
+    paths = [path for path in paths if path]
+    if paths:
+        enqueue_job(db, "delete_files", paths=paths)
+
+def release_log_images(db: Session, *criteria):
+    # 削除されるクエスト・グループの証拠画像を参照から外し、ファイルの削除をワーカーに回す
+    logs = db.query(
+        models.QuestCompletionLog.proof_image_path, models.QuestCompletionLog.thumbnail_path
     ).filter(
-        models.QuestCompletionLog.user_id == user_id
-    ).order_by(models.QuestCompletionLog.completed_at.desc()).all()
\ No newline at end of file
+        *criteria,
+        or_(
+            models.QuestCompletionLog.proof_image_path.isnot(None),
+            models.QuestCompletionLog.thumbnail_path.isnot(None)
+        )
+    ).all()
+    if not logs:
+        return
+    delete_files_later(db, [path for log in logs for path in log])
+    db.query(models.QuestCompletionLog).filter(*criteria).update(
+        {"proof_image_path": None, "thumbnail_path": None},
+        synchronize_session=False
+    )
+
+def claim_jobs(db: Session, limit: int):
+    # 他のワーカーが処理中の行は飛ばす。取り出した行のロックは呼び出し元のコミットまで保持される
+    return db.query(models.Job).filter(
+        models.Job.status == "pending",
+        models.Job.run_after <= datetime.now()
+    ).order_by(models.Job.id).with_for_update(skip_locked=True).limit(limit).all()
+
+def fail_job(db: Session, job: models.Job, error: str, max_attempts: int):
+    job.attempts += 1
+    job.last_error = error
+    if job.attempts >= max_attempts:
+        job.status = "failed"
+    else:
+        job.run_after = datetime.now() + timedelta(seconds=min(2 ** job.attempts * 30, 3600))
+
+def get_referenced_upload_paths(db: Session, among: list[str] | None = None) -> set[str]:
+    # 保存先は内容で名前が決まり、同じ画像は複数のログから共有されるので、削除前にこれで参照を確かめる
+    proof = models.QuestCompletionLog.proof_image_path
+    thumb = models.QuestCompletionLog.thumbnail_path
+    proofs = db.query(proof).filter(proof.isnot(None))
+    thumbs = db.query(thumb).filter(thumb.isnot(None))
+    if among is not None:
+        proofs = proofs.filter(proof.in_(among))
+        thumbs = thumbs.filter(thumb.in_(among))
+    return {path for (path,) in proofs.union(thumbs)}
@@ -0,0 +1,150 @@
+import models, schemas, events
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+
+# crud.py のホットパスを AsyncSession 向けに移植したもの (DB_ASYNC=true の場合に async_routes.py から使用)
+
+async def get_group_detail(db: AsyncSession, group_id: int):
+    result = await db.execute(
+        select(models.Group)
+        .options(
+            selectinload(models.Group.members).joinedload(models.UserGroup.user),
+            selectinload(models.Group.shops.and_(models.Shop.is_active == True)),
+            selectinload(models.Group.quests)
+        )
+        .where(models.Group.id == group_id)
+    )
+    group = result.scalars().first()
+    if not group:
+        return None
+
+    users_data = []
+    hosts_data = []
+
+    for member in group.members:
+        users_data.append({
+            "id": member.user.id,
+            "user_name": member.user.user_name,
+            "points": member.points,
+            "is_host": member.is_host
+        })
+        if member.is_host or member.user.id == group.owner_user_id:
+            hosts_data.append({
+                "id": member.user.id,
+                "user_name": member.user.user_name
+            })
+
+    return {
+        "id": group.id,
+        "group_name": group.group_name,
+        "owner_user_id": group.owner_user_id,
+        "invite_code": group.invite_code,
+        "users": users_data,
+        "hosts": hosts_data,
+        "shops": group.shops,
+        "quests": group.quests
+    }
+
+async def purchase_item(db: AsyncSession, user_id: int, item_id: int):
+    shop_item = (await db.execute(
+        select(models.Shop).where(models.Shop.id == item_id, models.Shop.is_active == True)
+    )).scalars().first()
+    if not shop_item:
+        return None, "Item not found"
+    limit = shop_item.limit_per_user
+    if limit is not None:
+        counter = models.PurchaseCounter
+        bumped = (await db.execute(
+            pg_insert(counter)
+            .values(user_id=user_id, shop_item_id=item_id, purchase_count=1)
+            .on_conflict_do_update(
+                index_elements=[counter.user_id, counter.shop_item_id],
+                set_={"purchase_count": counter.purchase_count + 1},
+                where=counter.purchase_count < limit
+            )
+            .returning(counter.purchase_count)
+        )).scalar()
+        if bumped is None or bumped > limit:
+            await db.rollback()
+            return None, f"Purchase limit reached (Max: {limit})"
+    remaining = (await db.execute(
+        update(models.UserGroup)
+        .where(
+            models.UserGroup.user_id == user_id,
+            models.UserGroup.group_id == shop_item.group_id,
+            models.UserGroup.points >= shop_item.cost_points
+        )
+        .values(points=models.UserGroup.points - shop_item.cost_points)
+        .returning(models.UserGroup.points)
+    )).scalar()
+    if remaining is None:
+        await db.rollback()
+        member = (await db.execute(
+            select(models.UserGroup.id).where(
+                models.UserGroup.user_id == user_id,
+                models.UserGroup.group_id == shop_item.group_id
+            )
+        )).first()
+        return None, "Not enough points" if member else "User not in group"
+    history = models.PurchaseHistory(
+        user_id=user_id,
+        group_id=shop_item.group_id,
+        shop_item_id=shop_item.id,
+        item_name=shop_item.item_name,
+        cost=shop_item.cost_points
+    )
+    db.add(history)
+    await db.flush()
+    db.add(models.PointsLedger(
+        user_id=user_id,
+        group_id=shop_item.group_id,
+        delta=-shop_item.cost_points,
+        balance_after=remaining,
+        reason="purchase",
+        ref_id=history.id
+    ))
+    events.emit(db.sync_session, shop_item.group_id, "purchase", user_id=user_id, shop_item_id=shop_item.id, purchase_id=history.id)
+    events.emit(db.sync_session, shop_item.group_id, "points_changed", user_id=user_id, points=remaining)
+    await db.commit()
+    return remaining, "Success"
+
+async def is_group_host(db: AsyncSession, user_id: int, group_id: int) -> bool:
+    is_host = (await db.execute(
+        select(models.UserGroup.is_host).where(
+            models.UserGroup.user_id == user_id,
+            models.UserGroup.group_id == group_id
+        )
+    )).scalars().first()
+    return bool(is_host)
+
+async def get_pending_submissions(db: AsyncSession, group_id: int):
+    logs = (await db.execute(
+        select(models.QuestCompletionLog)
+        .options(
+            joinedload(models.QuestCompletionLog.user),
+            joinedload(models.QuestCompletionLog.quest)
+        )
+        .where(
+            models.QuestCompletionLog.group_id == group_id,
+            models.QuestCompletionLog.status == "pending"
+        )
+    )).scalars().all()
+    results = []
+    for log in logs:
+        item = schemas.QuestCompletionLog.model_validate(log)
+        if log.user:
+            item.user_name = log.user.user_name
+        if log.quest:
+            item.quest_title = log.quest.quest_name
+        results.append(item)
+    return results
+
+async def get_my_quest_logs(db: AsyncSession, group_id: int, user_id: int):
+    return (await db.execute(
+        select(models.QuestCompletionLog).where(
+            models.QuestCompletionLog.group_id == group_id,
+            models.QuestCompletionLog.user_id == user_id
+        )
+    )).scalars().all()
@@ -0,0 +1,63 @@
+import hashlib
+from starlette.datastructures import Headers, MutableHeaders
+
+class ETagMiddleware:
+    """
+    GET の JSON レスポンス (200) に本文のハッシュから作った弱い ETag を付け、
+    If-None-Match が一致すれば本文を送らずに 304 を返す ASGI ミドルウェア。
+    フロントエンド (HomeQuestAPI) のキャッシュ再検証用。ストリーミング応答はそのまま流します。
+    """
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _etag(body: bytes) -> str:
+        return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        candidates = {tag.strip() for tag in if_none_match.split(",") if tag.strip()}
+        pending_start = None
+
+        async def etag_send(message):
+            nonlocal pending_start
+            if message["type"] == "http.response.start":
+                content_type = Headers(raw=message["headers"]).get("content-type", "")
+                if message["status"] == 200 and content_type.startswith("application/json"):
+                    # 本文を見てから ETag を決めるので開始メッセージを保留する
+                    pending_start = message
+                    return
+                await send(message)
+                return
+
+            if pending_start is None:
+                await send(message)
+                return
+
+            start, pending_start = pending_start, None
+            if message.get("more_body", False):
+                # 複数チャンクに分かれる応答はハッシュせずに流す
+                await send(start)
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            etag = self._etag(body)
+            headers = MutableHeaders(scope=start)
+            headers["etag"] = etag
+            headers["cache-control"] = "private, no-cache"
+            if etag in candidates or "*" in candidates:
+                del headers["content-length"]
+                del headers["content-type"]
+                start["status"] = 304
+                await send(start)
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, etag_send)
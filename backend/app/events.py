@@ -0,0 +1,134 @@
+import asyncio, json, os, select, threading, time, metrics
+from datetime import datetime
+from sqlalchemy import event, func, select as sa_select
+from sqlalchemy.orm import Session
+from database import engine
+
+# グループ単位のイベント配信 (GET /groups/{group_id}/events の SSE 用)
+# memory  : このプロセス内の購読者にだけ配信 (uvicorn ワーカー1つの場合)
+# postgres: コミット時に pg_notify し、各ワーカーの LISTEN スレッドが受け取って配信 (複数ワーカーの場合)
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+EVENTS_CHANNEL = "homequest_events"
+SUBSCRIBER_QUEUE_SIZE = 100
+_PENDING_KEY = "pending_events"
+
+EVENTS_PUBLISHED = metrics.counter("events_published_total", "Group events delivered to local subscribers")
+EVENTS_DROPPED = metrics.counter("events_dropped_total", "Group events dropped because a subscriber queue was full")
+
+class EventBroker:
+    """
+    グループIDごとの購読者 (asyncio.Queue) を管理するプロセス内 pub/sub。
+    publish はスレッドプールや LISTEN スレッドからも呼べるよう、各購読者のイベントループに
+    call_soon_threadsafe で受け渡します。
+    """
+    def __init__(self):
+        self._subscribers: dict[int, set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, group_id: int) -> tuple[asyncio.AbstractEventLoop, asyncio.Queue]:
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(group_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, group_id: int, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(group_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[group_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, item: dict):
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # 読み出しが追いつかない購読者には溜まった分を捨てて再取得を促す
+            EVENTS_DROPPED.inc(queue.qsize())
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"type": "resync", "group_id": item["group_id"], "data": {}})
+
+    def publish(self, item: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(item["group_id"], ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, item)
+            except RuntimeError:
+                # ループが閉じている (切断済み) 購読者
+                continue
+            EVENTS_PUBLISHED.inc()
+
+broker = EventBroker()
+metrics.gauge("events_subscribers", "Open group event streams in this worker", broker.subscriber_count)
+
+def emit(db: Session, group_id: int, event_type: str, **data):
+    # コミットされた変更だけを配信するため、セッションに積んでおきコミット時に送る
+    item = {"type": event_type, "group_id": group_id, "data": data, "at": datetime.now().isoformat()}
+    db.info.setdefault(_PENDING_KEY, []).append(item)
+
+@event.listens_for(Session, "before_commit")
+def _notify_in_transaction(session: Session):
+    # NOTIFY はトランザクションに含まれ、コミットされたときだけ他のワーカーに届く
+    if EVENTS_BACKEND == "postgres":
+        for item in session.info.get(_PENDING_KEY, ()):
+            session.execute(sa_select(func.pg_notify(EVENTS_CHANNEL, json.dumps(item, default=str))))
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session: Session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending and EVENTS_BACKEND != "postgres":
+        for item in pending:
+            broker.publish(item)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session):
+    session.info.pop(_PENDING_KEY, None)
+
+def _listen_forever():
+    while True:
+        try:
+            raw = engine.raw_connection()
+            # プールに返さずこのスレッド専用の接続にする
+            raw.detach()
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {EVENTS_CHANNEL}")
+            print(f"[INFO] Listening for group events on {EVENTS_CHANNEL}")
+            while True:
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    broker.publish(json.loads(notify.payload))
+        except Exception as e:
+            print(f"[WARN] Event listener disconnected: {e}")
+            time.sleep(5)
+
+def start_listener():
+    if EVENTS_BACKEND == "postgres":
+        threading.Thread(target=_listen_forever, name="event-listener", daemon=True).start()
+
+async def stream(group_id: int, is_disconnected, keepalive: float = 15.0):
+    # SSE 形式のイベント列。keepalive 秒ごとにコメント行を送り、プロキシによる切断を防ぐ
+    subscriber = broker.subscribe(group_id)
+    _, queue = subscriber
+    try:
+        yield ": connected\n\n"
+        while not await is_disconnected():
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {item['type']}\ndata: {json.dumps(item, default=str, ensure_ascii=False)}\n\n"
+    finally:
+        broker.unsubscribe(group_id, subscriber)
@@ -0,0 +1,47 @@
+import csv, io, json, crud
+from datetime import datetime
+from database import SessionLocal
+
+# 履歴エクスポート (GET /groups/{group_id}/history/{kind}/export)
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = {
+    "purchases": ["id", "user_name", "item_name", "cost", "purchased_at"],
+    "quests": ["id", "user_id", "user_name", "quest_id", "quest_title", "status", "completed_at"],
+}
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+def _iter_rows(db, group_id: int, kind: str, since: datetime | None, until: datetime | None):
+    if kind == "purchases":
+        return crud.iter_group_purchase_history(db, group_id, since, until, EXPORT_BATCH_SIZE)
+    return crud.iter_group_quest_history(db, group_id, since, until, EXPORT_BATCH_SIZE)
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def stream_group_history(group_id: int, kind: str, fmt: str, since: datetime | None = None, until: datetime | None = None):
+    """
+    履歴を CSV / NDJSON の文字列チャンクとして順に返すジェネレーター。
+    StreamingResponse がレスポンス送信中に (スレッドプールで) 回すので、
+    リクエストのセッションではなく専用のセッションを開き、送信が終わるまで保持します。
+    メモリに載るのは EXPORT_BATCH_SIZE 件分だけです。
+    """
+    columns = EXPORT_COLUMNS[kind]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(columns)
+
+    with SessionLocal() as db:
+        for count, row in enumerate(_iter_rows(db, group_id, kind, since, until), start=1):
+            if fmt == "csv":
+                writer.writerow([_plain(row[c]) for c in columns])
+            else:
+                buffer.write(json.dumps({c: _plain(row[c]) for c in columns}, ensure_ascii=False) + "\n")
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,35 @@
+import os, crud, storage
+from io import BytesIO
+from PIL import Image, ImageOps
+from database import SessionLocal
+
+# 証拠画像の後処理 (complete_quest のレスポンス後に BackgroundTasks で実行)
+PROOF_MAX_DIMENSION = int(os.getenv("PROOF_MAX_DIMENSION", "1600"))
+THUMBNAIL_DIMENSION = int(os.getenv("THUMBNAIL_DIMENSION", "320"))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+
+def _encode_webp(img: Image.Image, max_dimension: int) -> bytes:
+    resized = img.copy()
+    resized.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    # exif を渡さずに再エンコードするので位置情報などのメタデータは残らない
+    buffer = BytesIO()
+    resized.save(buffer, "WEBP", quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+def process_proof_image(log_id: int, original_path: str):
+    try:
+        with storage.backend.open(original_path) as src, Image.open(src) as img:
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            proof = _encode_webp(img, PROOF_MAX_DIMENSION)
+            thumbnail = _encode_webp(img, THUMBNAIL_DIMENSION)
+    except (OSError, Image.DecompressionBombError) as e:
+        # 画像として読めない場合は元ファイルのまま残す
+        print(f"[WARN] Failed to process image {original_path}: {e}")
+        return
+
+    proof_path = storage.backend.put_bytes(proof, ".webp")
+    thumbnail_path = storage.backend.put_bytes(thumbnail, ".webp")
+    # 不要になった方のファイル (差し替え後の元画像、または処理中に審査済みになった場合の変換結果) は
+    # set_processed_proof_image がワーカーでの削除に回す
+    with SessionLocal() as db:
+        crud.set_processed_proof_image(db, log_id, original_path, proof_path, thumbnail_path)
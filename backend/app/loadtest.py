@@ -0,0 +1,99 @@
+"""
+同期モードと async モード (DB_ASYNC=true) の負荷比較
+
+    # 同期版を :8000、async 版を :8001 で起動しておく
+    APP_API_KEY=... python loadtest.py --sync-url http://localhost:8000 --async-url http://localhost:8001 \
+        --user-id 1 --password pass --group-id 1 --item-id 1
+
+GET /groups/{group_id} と POST /shops/{item_id}/purchase をそれぞれ同じ並列度で叩き、
+requests/sec と p50 / p99 レイテンシを表示します。
+購入側は残高や購入上限で 400 になっても計測は続けるので、
+cost_points=0・上限なしの検証用アイテムを使うと比較しやすくなります。
+"""
+import argparse, http.client, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+def login(base_url: str, api_key: str, user_id: int, password: str) -> str:
+    url = urlsplit(base_url)
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    body = urlencode({"username": str(user_id), "password": password})
+    conn.request("POST", "/token", body=body, headers={
+        "X-App-Key": api_key,
+        "Content-Type": "application/x-www-form-urlencoded",
+    })
+    res = conn.getresponse()
+    data = json.loads(res.read())
+    if res.status != 200:
+        raise SystemExit(f"login failed on {base_url}: {data}")
+    return data["access_token"]
+
+def run(base_url: str, method: str, path: str, headers: dict, total: int, concurrency: int):
+    url = urlsplit(base_url)
+    local = threading.local()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        # スレッドごとに keep-alive 接続を使い回す
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        start = time.perf_counter()
+        try:
+            local.conn.request(method, path, headers=headers)
+            res = local.conn.getresponse()
+            res.read()
+            ok = res.status < 400
+        except (http.client.HTTPException, OSError):
+            local.conn.close()
+            del local.conn
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    return {
+        "rps": total / wall,
+        "p50_ms": pick(0.50),
+        "p99_ms": pick(0.99),
+        "errors": errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sync-url", required=True)
+    parser.add_argument("--async-url", required=True)
+    parser.add_argument("--api-key", default=os.getenv("APP_API_KEY"))
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--group-id", type=int, required=True)
+    parser.add_argument("--item-id", type=int, required=True)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    targets = [
+        ("GET", f"/groups/{args.group_id}"),
+        ("POST", f"/shops/{args.item_id}/purchase"),
+    ]
+    print(f"{'mode':<6} {'endpoint':<28} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for mode, base_url in (("sync", args.sync_url), ("async", args.async_url)):
+        token = login(base_url, args.api_key, args.user_id, args.password)
+        headers = {"X-App-Key": args.api_key, "Authorization": f"Bearer {token}"}
+        for method, path in targets:
+            r = run(base_url, method, path, headers, args.requests, args.concurrency)
+            print(f"{mode:<6} {method + ' ' + path:<28} {r['rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['errors']:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
-import models, schemas, crud, auth, os, uuid
-from fastapi import FastAPI, Depends, HTTPException, status, Security, Request, UploadFile, File
+import models, schemas, crud, auth, metrics, database, async_routes, uploads, images, exports, etags, events, storage, os
+from fastapi import FastAPI, Depends, HTTPException, status, Security, Request, UploadFile, File, Query, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm, APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from database import Base, engine, get_db
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from database import Base, engine, SessionLocal, get_db, add_missing_columns, create_indexes
+from sqlalchemy import inspect
 from sqlalchemy.orm import Session
-from datetime import timedelta
-from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Literal
 
 API_KEY = os.getenv("APP_API_KEY")
 API_KEY_NAME = "X-App-Key"
@@ -29,8 +31,25 @@ async def get_api_key(
             detail="Could not validate credentials (API Key is missing or invalid)"
         )
 
+inspector = inspect(engine)
+new_tables = {name for name in Base.metadata.tables if not inspector.has_table(name)}
 Base.metadata.create_all(bind=engine)
+add_missing_columns()
+if models.UserGroup.__tablename__ not in new_tables:
+    # ux_user_groups_user_group (一意) を作る前に、以前の同時参加で重複した行をまとめておく
+    with SessionLocal() as db:
+        crud.dedupe_memberships(db)
+create_indexes()
+# 既存データから派生テーブルを初期化する (テーブルを新規作成した起動時のみ)
+with SessionLocal() as db:
+    if models.PurchaseCounter.__tablename__ in new_tables:
+        crud.backfill_purchase_counters(db)
+    if models.PointsLedger.__tablename__ in new_tables:
+        crud.backfill_points_ledger(db)
+events.start_listener()
 app = FastAPI(dependencies=[Depends(get_api_key)])
+app.add_middleware(uploads.UploadSizeLimitMiddleware)
+app.add_middleware(etags.ETagMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -39,58 +58,103 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = Path(__file__).resolve().parent / "uploads"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-app.mount("/static", StaticFiles(directory=UPLOAD_DIR), name="static")
+# async モード: 同じパスの同期版より先に登録してこちらを優先させる
+if database.DB_ASYNC:
+    app.include_router(async_routes.router)
+
+# 証拠画像の配信 (保存先は STORAGE_BACKEND で切り替え。URL は従来どおり /static/...)
+app.mount("/static", storage.backend.static_app(), name="static")
+
+def get_group_membership(
+    group_id: int,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+) -> schemas.Membership:
+    # 呼び出し元のロール (メンバー/ホスト/オーナー) をリクエストごとに1回だけ解決してハンドラと共有する
+    return crud.get_membership(db, current_user.id, group_id)
+
+def get_group_includes(
+    include: str | None = Query(None, description="shops,quests,counts をカンマ区切りで指定")
+) -> set[str]:
+    requested = {part.strip() for part in (include or "").split(",") if part.strip()}
+    unknown = requested - crud.GROUP_INCLUDES
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"include に指定できない値です: {', '.join(sorted(unknown))}")
+    return requested
+
+def get_history_page(
+    cursor: str | None = None,
+    limit: int = Query(crud.HISTORY_PAGE_LIMIT, ge=1, le=crud.HISTORY_MAX_LIMIT),
+    since: datetime | None = None,
+    until: datetime | None = None
+) -> dict:
+    # 履歴系エンドポイント共通のページング条件 (cursor にはレスポンスの next_cursor をそのまま渡す)
+    try:
+        after = crud.decode_history_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor が不正です")
+    return {"after": after, "limit": limit, "since": since, "until": until}
 
 # health check
 @app.get("/")
 def root():
     return {"message": "HomeQuest backend is running!"}
 
+# metrics (Prometheus text format)
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    return metrics.render()
+
 # create user
 @app.post("/users", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    return crud.create_user(db, user)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    # bcrypt は auth 側の専用ワーカーで計算する
+    hashed_password = await auth.hash_password(user.password)
+    return await run_in_threadpool(crud.create_user, db, user, hashed_password)
 
 # get users
 @app.get("/users", response_model=list[schemas.UserWithGroups])
-def read_users(db: Session = Depends(get_db)):
-    return crud.get_users(db)
+def read_users(
+    after_id: int | None = None,
+    limit: int = Query(crud.USERS_PAGE_LIMIT, ge=1, le=crud.USERS_PAGE_LIMIT),
+    db: Session = Depends(get_db)
+):
+    # after_id には前ページ最後のユーザーIDを渡す (keyset pagination)
+    return crud.get_users(db, after_id=after_id, limit=limit)
 
 # get purchases log
-@app.get("/users/me/purchases", response_model=list[schemas.PurchaseLog])
+@app.get("/users/me/purchases", response_model=schemas.PurchaseLogPage)
 def read_own_purchases(
+    page: dict = Depends(get_history_page),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    return crud.get_user_purchases(db=db, user_id=current_user.id)
+    return crud.get_user_purchases(db=db, user_id=current_user.id, **page)
 
 # create group
 @app.post("/groups", response_model=schemas.Group)
 def create_group(
     group: schemas.GroupCreate, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
     # グループ作成処理
     new_group = crud.create_group(db=db, group=group, owner_id=current_user.id)
     
     # --- 追加: 初回フラグの更新 ---
     if current_user.is_first_login:
-        current_user.is_first_login = False
-        db.commit()
+        crud.clear_first_login(db, current_user.id)
     
     return new_group
 
 # get groups
-@app.get("/groups", response_model=list[schemas.Group])
-def read_groups(db: Session = Depends(get_db)):
-    return crud.get_groups(db)
+@app.get("/groups", response_model=list[schemas.GroupSummary], response_model_exclude_none=True)
+def read_groups(include: set[str] = Depends(get_group_includes), db: Session = Depends(get_db)):
+    return crud.get_groups(db, include)
 
 # get group detail
 @app.get("/groups/{group_id}", response_model=schemas.GroupDetail)
-def read_group_detail(group_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+def read_group_detail(group_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(auth.get_current_user)):
     group = crud.get_group_detail(db, group_id)
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
@@ -98,8 +162,8 @@ def read_group_detail(group_id: int, db: Session = Depends(get_db), current_user
 
 # create invite code
 @app.post("/groups/{group_id}/invite_code")
-def generate_invite_code(group_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    if not crud.is_group_host(db, current_user.id, group_id):
+def generate_invite_code(group_id: int, db: Session = Depends(get_db), membership: schemas.Membership = Depends(get_group_membership)):
+    if not membership.is_host:
         raise HTTPException(status_code=403, detail="権限がありません。ホストのみ実行可能です。")
     code = crud.create_invite_code(db, group_id)
     if not code:
@@ -108,7 +172,7 @@ def generate_invite_code(group_id: int, db: Session = Depends(get_db), current_u
 
 # join group
 @app.post("/groups/join")
-def join_group(request: schemas.JoinGroupRequest, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+def join_group(request: schemas.JoinGroupRequest, db: Session = Depends(get_db), current_user: schemas.User = Depends(auth.get_current_user)):
     group, message = crud.join_group_by_code(db, current_user.id, request.invite_code)
     
     if not group:
@@ -116,8 +180,7 @@ def join_group(request: schemas.JoinGroupRequest, db: Session = Depends(get_db),
     
     # --- 追加: 初回フラグの更新 ---
     if current_user.is_first_login:
-        current_user.is_first_login = False
-        db.commit()
+        crud.clear_first_login(db, current_user.id)
         
     return {
         "message": f"グループ「{group.group_name}」に参加しました！",
@@ -126,8 +189,8 @@ def join_group(request: schemas.JoinGroupRequest, db: Session = Depends(get_db),
 
 # regen invite code
 @app.post("/groups/{group_id}/reset_invite_code")
-def reset_invite_code(group_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    if not crud.is_group_host(db, current_user.id, group_id):
+def reset_invite_code(group_id: int, db: Session = Depends(get_db), membership: schemas.Membership = Depends(get_group_membership)):
+    if not membership.is_host:
         raise HTTPException(status_code=403, detail="権限がありません。ホストのみ実行可能です。")
     code = crud.regenerate_invite_code(db, group_id)
     if not code:
@@ -141,9 +204,10 @@ def update_member_role(
     user_id: int, 
     role_update: schemas.MemberRoleUpdate, 
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user),
+    membership: schemas.Membership = Depends(get_group_membership)
 ):
-    if not crud.is_group_owner(db, current_user.id, group_id):
+    if not membership.is_owner:
         raise HTTPException(status_code=403, detail="オーナーのみ実行可能です")
     if current_user.id == user_id:
         raise HTTPException(status_code=400, detail="オーナー自身の権限は変更できません")
@@ -160,9 +224,10 @@ def remove_member_from_group(
     group_id: int, 
     user_id: int, 
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user),
+    membership: schemas.Membership = Depends(get_group_membership)
 ):
-    if not crud.is_group_owner(db, current_user.id, group_id):
+    if not membership.is_owner:
         raise HTTPException(status_code=403, detail="オーナーのみ実行可能です")
     if current_user.id == user_id:
         raise HTTPException(status_code=400, detail="オーナー自身をグループから削除することはできません")
@@ -178,9 +243,9 @@ def create_shop_item(
     group_id: int, 
     shop_item: schemas.ShopCreate, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    membership: schemas.Membership = Depends(get_group_membership)
 ):
-    if not crud.is_group_host(db, current_user.id, group_id):
+    if not membership.is_host:
         raise HTTPException(status_code=403, detail="権限がありません。商品追加はホストのみ可能です。")
     return crud.create_shop_item(db=db, shop_item=shop_item, group_id=group_id)
 
@@ -189,26 +254,26 @@ def create_shop_item(
 def purchase_item(
     item_id: int, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    user_group, message = crud.purchase_item(db=db, user_id=current_user.id, item_id=item_id)
+    remaining, message = crud.purchase_item(db=db, user_id=current_user.id, item_id=item_id)
     
-    if not user_group:
+    if remaining is None:
         raise HTTPException(status_code=400, detail=message)
     
     return {
-        "message": f"Purchase successful! Remaining points: {user_group.points}",
-        "current_points": user_group.points
+        "message": f"Purchase successful! Remaining points: {remaining}",
+        "current_points": remaining
     }
 
 # delete item
 @app.delete("/shops/{item_id}")
-def delete_shop_item(item_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+def delete_shop_item(item_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(auth.get_current_user)):
     item = crud.get_shop_item(db, item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
 
-    if not crud.is_group_host(db, current_user.id, item.group_id):
+    if not crud.get_membership(db, current_user.id, item.group_id).is_host:
         raise HTTPException(status_code=403, detail="権限がありません。商品削除はホストのみ可能です。")
 
     crud.delete_shop_item(db, item_id)
@@ -220,9 +285,9 @@ def create_quest(
     group_id: int, 
     quest: schemas.QuestCreate, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    membership: schemas.Membership = Depends(get_group_membership)
 ):
-    if not crud.is_group_host(db, current_user.id, group_id):
+    if not membership.is_host:
         raise HTTPException(status_code=403, detail="権限がありません。クエスト作成はホストのみ可能です。")
     return crud.create_quest(db=db, quest=quest, group_id=group_id)
 
@@ -230,22 +295,28 @@ def create_quest(
 @app.post("/quests/{quest_id}/complete")
 async def complete_quest(
     quest_id: int, 
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    extension = os.path.splitext(file.filename)[1]
-    safe_filename = f"{current_user.id}_{quest_id}_{uuid.uuid4()}{extension}"
-    file_path = UPLOAD_DIR / safe_filename
-    contents = await file.read()
-    with open(file_path, "wb") as buffer:
-        buffer.write(contents)
-    db_path = f"/static/{safe_filename}"
-    result, message = crud.submit_quest_completion(db, current_user.id, quest_id, db_path)
-    if not result:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    # 重複提出はファイルを書き込む前に弾く
+    quest, message = await run_in_threadpool(crud.get_submittable_quest, db, current_user.id, quest_id)
+    if not quest:
+        raise HTTPException(status_code=400, detail=message)
+    extension = storage.safe_suffix(file.filename)
+    staging_path = await run_in_threadpool(storage.new_staging_file, extension)
+    saved = await run_in_threadpool(uploads.save_upload, file.file, staging_path)
+    if not saved:
+        raise HTTPException(status_code=413, detail=f"File too large (Max: {uploads.MAX_UPLOAD_BYTES} bytes)")
+    # 内容のハッシュで保存する (同じ画像の再提出は保存済みのファイルを共有する)
+    db_path = await run_in_threadpool(storage.backend.put_file, staging_path, extension)
+    log, message = await run_in_threadpool(crud.submit_quest_completion, db, current_user.id, quest_id, db_path)
+    if not log:
+        # 他の提出と共有している可能性があるのでここでは消さない (参照されなければワーカーの掃除で消える)
         raise HTTPException(status_code=400, detail=message)
+    # EXIF 除去・縮小・サムネイル生成はレスポンス後に行う
+    background_tasks.add_task(images.process_proof_image, log.id, db_path)
     return {"message": message}
 
 # get quest complete
@@ -253,9 +324,9 @@ async def complete_quest(
 def get_pending_submissions(
     group_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    membership: schemas.Membership = Depends(get_group_membership)
 ):
-    if not crud.is_group_host(db, current_user.id, group_id):
+    if not membership.is_host:
         raise HTTPException(status_code=403, detail="ホストのみ閲覧可能です")
     
     return crud.get_pending_submissions(db, group_id)
@@ -266,12 +337,13 @@ def review_submission(
     log_id: int,
     review: schemas.QuestReview,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
     log = db.query(models.QuestCompletionLog).filter(models.QuestCompletionLog.id == log_id).first()
     if not log:
         raise HTTPException(status_code=404, detail="提出が見つかりません")
-    if not crud.is_group_host(db, current_user.id, log.group_id) and not crud.is_group_owner(db, current_user.id, log.group_id):
+    membership = crud.get_membership(db, current_user.id, log.group_id)
+    if not membership.is_host and not membership.is_owner:
         raise HTTPException(status_code=403, detail="権限がありません")
     success, message = crud.review_quest_submission(db, log_id, review.approved)
     if not success:
@@ -281,18 +353,18 @@ def review_submission(
 
 # delete quest
 @app.delete("/quests/{quest_id}")
-def delete_quest(quest_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+def delete_quest(quest_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(auth.get_current_user)):
     quest = crud.get_quest(db, quest_id)
     if not quest:
         raise HTTPException(status_code=404, detail="Quest not found")
-    if not crud.is_group_host(db, current_user.id, quest.group_id):
+    if not crud.get_membership(db, current_user.id, quest.group_id).is_host:
         raise HTTPException(status_code=403, detail="権限がありません。クエスト削除はホストのみ可能です。")
     crud.delete_quest(db, quest_id)
     return {"message": "Quest deleted successfully"}
 
 # generate token
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
     db: Session = Depends(get_db)
 ):
@@ -304,7 +376,7 @@ def login_for_access_token(
             detail="User ID must be an integer",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = auth.authenticate_user(db, user_id=user_id, password=form_data.password)
+    user = await auth.authenticate_user(db, user_id=user_id, password=form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -313,7 +385,7 @@ def login_for_access_token(
         )
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": str(user.id)},
+        data=auth.user_claims(user),
         expires_delta=access_token_expires
     )
     # --- 修正: トークンと一緒に初回判定フラグを返す ---
@@ -325,34 +397,72 @@ def login_for_access_token(
 
 # get user info
 @app.get("/users/me", response_model=schemas.User)
-async def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
+async def read_users_me(current_user: schemas.User = Depends(auth.get_current_user)):
     return current_user
 
 # get purchase log
-@app.get("/groups/{group_id}/history/purchases", response_model=list[schemas.PurchaseLog])
-def read_group_purchase_history(group_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    return crud.get_group_purchase_history(db, group_id)
+@app.get("/groups/{group_id}/history/purchases", response_model=schemas.PurchaseLogPage)
+def read_group_purchase_history(group_id: int, page: dict = Depends(get_history_page), db: Session = Depends(get_db), current_user: schemas.User = Depends(auth.get_current_user)):
+    return crud.get_group_purchase_history(db, group_id, **page)
 
 # get quest log
-@app.get("/groups/{group_id}/history/quests", response_model=list[schemas.QuestCompletionLog])
-def read_group_quest_history(group_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    return crud.get_group_quest_history(db, group_id)
+@app.get("/groups/{group_id}/history/quests", response_model=schemas.QuestCompletionLogPage)
+def read_group_quest_history(group_id: int, page: dict = Depends(get_history_page), db: Session = Depends(get_db), current_user: schemas.User = Depends(auth.get_current_user)):
+    return crud.get_group_quest_history(db, group_id, **page)
+
+# export purchase / quest log
+@app.get("/groups/{group_id}/history/{kind}/export")
+def export_group_history(
+    group_id: int,
+    kind: Literal["purchases", "quests"],
+    fmt: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    membership: schemas.Membership = Depends(get_group_membership)
+):
+    if not membership.is_member:
+        raise HTTPException(status_code=403, detail="グループのメンバーのみ閲覧可能です")
+    # 全件を JSON にせず、サーバーサイドカーソルから読みながらそのまま送る
+    return StreamingResponse(
+        exports.stream_group_history(group_id, kind, fmt, since, until),
+        media_type=exports.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="group_{group_id}_{kind}_history.{fmt}"'}
+    )
+
+# group event stream (SSE)
+@app.get("/groups/{group_id}/events")
+async def stream_group_events(
+    group_id: int,
+    request: Request,
+    membership: schemas.Membership = Depends(get_group_membership),
+    db: Session = Depends(get_db)
+):
+    if not membership.is_member:
+        raise HTTPException(status_code=403, detail="グループのメンバーのみ閲覧可能です")
+    # 接続中ずっと DB 接続を握らないよう、権限確認に使ったセッションはここで返しておく
+    db.close()
+    return StreamingResponse(
+        events.stream(group_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # get user in group
-@app.get("/users/{user_id}/groups", response_model=list[schemas.Group])
+@app.get("/users/{user_id}/groups", response_model=list[schemas.GroupSummary], response_model_exclude_none=True)
 def read_user_joined_groups(
     user_id: int, 
+    include: set[str] = Depends(get_group_includes),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    return crud.get_user_joined_groups(db, user_id)
+    return crud.get_user_joined_groups(db, user_id, include)
 
 # leave group
 @app.post("/groups/{group_id}/leave")
 def leave_group(
     group_id: int, 
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
     success = crud.leave_group(db, group_id, current_user.id)
     if not success:
@@ -365,9 +475,10 @@ def leave_group(
 def delete_group_endpoint(
     group_id: int, 
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user),
+    membership: schemas.Membership = Depends(get_group_membership)
 ):
-    if not crud.is_group_owner(db, current_user.id, group_id):
+    if not membership.is_owner:
         raise HTTPException(status_code=403, detail="オーナーのみ削除可能です")
     
     success = crud.delete_group(db, group_id)
@@ -375,24 +486,60 @@ def delete_group_endpoint(
         raise HTTPException(status_code=404, detail="グループが見つかりません")
     return {"message": "グループを削除しました"}
 
+# get points ledger (自分の分。ホストは user_id を指定して他メンバーの分も見られる)
+@app.get("/groups/{group_id}/points/ledger", response_model=list[schemas.PointsLedgerEntry])
+def read_points_ledger(
+    group_id: int,
+    user_id: int | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(auth.get_current_user),
+    membership: schemas.Membership = Depends(get_group_membership)
+):
+    if not membership.is_member:
+        raise HTTPException(status_code=403, detail="グループのメンバーのみ閲覧可能です")
+    target_user_id = user_id or current_user.id
+    if target_user_id != current_user.id and not membership.is_host:
+        raise HTTPException(status_code=403, detail="他のメンバーの履歴はホストのみ閲覧可能です")
+    return crud.get_points_ledger(db, group_id, target_user_id, since, until)
+
 @app.get("/groups/{group_id}/my_submissions", response_model=list[schemas.QuestCompletionLog])
 def read_my_submissions(
     group_id: int, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
     return crud.get_my_quest_logs(db, group_id, current_user.id)
 
-@app.get("/users/me/history/purchases/all", response_model=list[schemas.PurchaseLog])
+@app.get("/users/me/history/purchases/all", response_model=schemas.PurchaseLogPage)
 def read_my_all_purchase_history(
+    page: dict = Depends(get_history_page),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    return crud.get_user_purchases(db, current_user.id)
+    return crud.get_user_purchases(db, current_user.id, **page)
 
-@app.get("/users/me/history/quests/all", response_model=list[schemas.QuestCompletionLog])
+@app.get("/users/me/history/quests/all", response_model=schemas.QuestCompletionLogPage)
 def read_my_all_quest_history(
+    page: dict = Depends(get_history_page),
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    return crud.get_user_quest_history_all(db, current_user.id, **page)
+
+# shop overview (参加中の全グループ分の残高・商品・残り購入回数・自分の購入履歴をまとめて返す)
+@app.get("/users/me/shop", response_model=schemas.ShopOverview)
+def read_my_shop_overview(
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    return crud.get_shop_overview(db, current_user.id)
+
+# quest board (参加中の全グループ分のクエスト・提出状況・承認待ちをまとめて返す)
+@app.get("/users/me/quest_board", response_model=schemas.QuestBoard)
+def read_my_quest_board(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    return crud.get_user_quest_history_all(db, current_user.id)
\ No newline at end of file
+    return crud.get_quest_board(db, current_user.id)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, DateTime, Index, JSON, text
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -34,6 +34,10 @@ class Group(Base):
 
 class UserGroup(Base):
     __tablename__ = "user_groups"
+    __table_args__ = (
+        Index("ux_user_groups_user_group", "user_id", "group_id", unique=True),
+        Index("ix_user_groups_group_id", "group_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -60,6 +64,12 @@ class Shop(Base):
 
 class PurchaseHistory(Base):
     __tablename__ = "purchase_history"
+    __table_args__ = (
+        Index("ix_purchase_history_user_item", "user_id", "shop_item_id"),
+        Index("ix_purchase_history_group_purchased_at", "group_id", "purchased_at"),
+        # 履歴のページング ((purchased_at, id) の降順 keyset) 用
+        Index("ix_purchase_history_user_purchased_at", "user_id", "purchased_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -73,6 +83,33 @@ class PurchaseHistory(Base):
     group = relationship("Group", back_populates="purchase_history")
     item = relationship("Shop", back_populates="purchase_history")
 
+class PurchaseCounter(Base):
+    # 購入上限付きアイテムの (ユーザー, アイテム) ごとの購入回数。COUNT(*) の代わりに条件付き UPSERT で上限を守る
+    __tablename__ = "purchase_counters"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    shop_item_id = Column(Integer, ForeignKey("shops.id"), primary_key=True)
+    purchase_count = Column(Integer, nullable=False, default=0)
+
+class PointsLedger(Base):
+    # ポイント増減の追記専用台帳。UserGroup.points はこの合計を実体化した残高キャッシュ
+    __tablename__ = "points_ledger"
+    __table_args__ = (
+        Index("ix_points_ledger_user_group_created_at", "user_id", "group_id", "created_at"),
+        Index("ix_points_ledger_group_created_at", "group_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
+    delta = Column(Integer, nullable=False)
+    balance_after = Column(Integer, nullable=False)
+    # purchase / quest_reward / opening_balance / membership_closed
+    reason = Column(String, nullable=False)
+    # purchase_history.id または quest_completion_logs.id
+    ref_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+
 class Quest(Base):
     __tablename__ = "quests"
     
@@ -90,6 +127,18 @@ class Quest(Base):
 
 class QuestCompletionLog(Base):
     __tablename__ = "quest_completion_logs"
+    __table_args__ = (
+        Index("ix_quest_logs_group_status", "group_id", "status"),
+        Index("ix_quest_logs_quest_user_status", "quest_id", "user_id", "status"),
+        # 承認待ち一覧 (get_pending_submissions) 専用の部分インデックス
+        Index(
+            "ix_quest_logs_pending_by_group", "group_id",
+            postgresql_where=text("status = 'pending'")
+        ),
+        # 履歴のページング ((completed_at, id) の降順 keyset) 用
+        Index("ix_quest_logs_group_completed_at", "group_id", "completed_at", "id"),
+        Index("ix_quest_logs_user_completed_at", "user_id", "completed_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -97,8 +146,27 @@ class QuestCompletionLog(Base):
     group_id = Column(Integer, ForeignKey("groups.id"))
     status = Column(String, default="pending") 
     proof_image_path = Column(String, nullable=True)
+    thumbnail_path = Column(String, nullable=True)
     completed_at = Column(DateTime, default=datetime.now)
     
     user = relationship("User", back_populates="quest_logs")
     quest = relationship("Quest", back_populates="logs")
-    group = relationship("Group", back_populates="quest_logs")
\ No newline at end of file
+    group = relationship("Group", back_populates="quest_logs")
+
+class Job(Base):
+    # コミット後に行う処理 (ファイル削除など) のキュー。呼び出し元と同じトランザクションで登録し、worker.py が処理する
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_pending_run_after", "run_after", postgresql_where=text("status = 'pending'")),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    # delete_files
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    # pending / failed (完了したジョブは削除する)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    run_after = Column(DateTime, default=datetime.now)
+    created_at = Column(DateTime, default=datetime.now)
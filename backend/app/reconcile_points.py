@@ -0,0 +1,51 @@
+"""
+ポイント台帳と残高キャッシュの突き合わせ
+
+    python reconcile_points.py                  # 1回だけ検証
+    python reconcile_points.py --interval 3600  # 1時間ごとに検証し続ける
+    python reconcile_points.py --fix            # 食い違いを台帳の合計に合わせて直す
+
+UserGroup.points (実体化された残高) と points_ledger の delta 合計を比較し、
+食い違いがあれば一覧を出力して終了コード 1 を返します。
+"""
+import argparse, sys, time, models, crud
+from database import SessionLocal
+from sqlalchemy import update
+
+def reconcile(fix: bool) -> int:
+    with SessionLocal() as db:
+        mismatches = crud.find_points_mismatches(db)
+        for member, ledger_total in mismatches:
+            print(
+                f"[MISMATCH] user_id={member.user_id} group_id={member.group_id} "
+                f"points={member.points} ledger_total={ledger_total}"
+            )
+            if fix:
+                # 台帳が正。検出後に残高が動いていなければキャッシュ側を台帳の合計に合わせる
+                db.execute(
+                    update(models.UserGroup)
+                    .where(
+                        models.UserGroup.id == member.id,
+                        models.UserGroup.points == member.points
+                    )
+                    .values(points=ledger_total)
+                )
+        if fix and mismatches:
+            db.commit()
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] reconciled: {len(mismatches)} mismatch(es)")
+    return len(mismatches)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interval", type=int, default=0, help="秒。0 なら1回だけ実行")
+    parser.add_argument("--fix", action="store_true")
+    args = parser.parse_args()
+
+    while True:
+        mismatches = reconcile(args.fix)
+        if args.interval <= 0:
+            sys.exit(1 if mismatches and not args.fix else 0)
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -41,6 +41,39 @@ class PurchaseLog(BaseModel):
     
     model_config = {"from_attributes": True}
 
+class PurchaseLogPage(BaseModel):
+    items: list[PurchaseLog]
+    next_cursor: str | None = None
+
+class ShopOverviewItem(Shop):
+    # 自分があと何回買えるか (上限なしの商品は None)
+    remaining_purchases: int | None = None
+
+class ShopOverviewGroup(BaseModel):
+    id: int
+    group_name: str
+    owner_user_id: int
+    is_host: bool
+    is_owner: bool
+    points: int
+    items: list[ShopOverviewItem]
+    recent_purchases: list[PurchaseLog]
+
+class ShopOverview(BaseModel):
+    groups: list[ShopOverviewGroup]
+
+class PointsLedgerEntry(BaseModel):
+    id: int
+    user_id: int
+    group_id: int
+    delta: int
+    balance_after: int
+    reason: str
+    ref_id: int | None = None
+    created_at: datetime
+
+    model_config = {"from_attributes": True}
+
 class QuestCreate(BaseModel):
     quest_name: str
     description: str | None = None
@@ -61,6 +94,7 @@ class QuestCompletionLog(BaseModel):
     group_id: int
     status: str
     proof_image_path: str | None = None
+    thumbnail_path: str | None = None
     completed_at: datetime | None = None
     
     user_name: str | None = None
@@ -68,6 +102,26 @@ class QuestCompletionLog(BaseModel):
 
     model_config = {"from_attributes": True}
 
+class QuestCompletionLogPage(BaseModel):
+    items: list[QuestCompletionLog]
+    next_cursor: str | None = None
+
+class QuestBoardSubmission(QuestCompletionLog):
+    reward_points: int | None = None
+
+class QuestBoardGroup(BaseModel):
+    id: int
+    group_name: str
+    owner_user_id: int
+    is_host: bool
+    is_owner: bool
+
+class QuestBoard(BaseModel):
+    groups: list[QuestBoardGroup]
+    active_quests: list[Quest]
+    my_submissions: list[QuestBoardSubmission]
+    pending_reviews: list[QuestCompletionLog]
+
 class QuestReview(BaseModel):
     approved: bool
 
@@ -83,6 +137,25 @@ class Group(BaseModel):
     
     model_config = {"from_attributes": True}
 
+class ShopSummary(BaseModel):
+    id: int
+    item_name: str
+
+class QuestSummary(BaseModel):
+    id: int
+    quest_name: str
+
+class GroupSummary(BaseModel):
+    id: int
+    group_name: str
+    owner_user_id: int
+    # 以下は include で指定されたときだけ含まれる
+    shops: list[ShopSummary] | None = None
+    quests: list[QuestSummary] | None = None
+    shop_count: int | None = None
+    quest_count: int | None = None
+    member_count: int | None = None
+
 class JoinGroupRequest(BaseModel):
     invite_code: str
 
@@ -119,6 +192,14 @@ class UserWithGroups(BaseModel):
     
     model_config = {"from_attributes": True}
 
+class Membership(BaseModel):
+    user_id: int
+    group_id: int
+    group_exists: bool
+    is_member: bool
+    is_host: bool
+    is_owner: bool
+
 class MemberRoleUpdate(BaseModel):
     is_host: bool
 
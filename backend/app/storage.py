@@ -0,0 +1,289 @@
+import hashlib, mimetypes, os, re, tempfile
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, Iterator
+from urllib.parse import quote
+from fastapi.staticfiles import StaticFiles
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, RedirectResponse, Response
+from starlette.routing import Route
+from starlette.staticfiles import NotModifiedResponse
+
+# 証拠画像の保存先
+# local: uploads/ 以下に内容の sha256 を名前にして ab/cd/<digest><ext> に保存する (同じ内容は1ファイルにまとまる)
+# s3   : S3 互換ストレージ (MinIO など) に同じキーで保存し、/static/<key> は署名付き URL へリダイレクトする
+# どちらも DB には /static/<key> の形で記録する (以前のフラットな /static/<uuid>.jpg もそのまま配信される)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+UPLOAD_DIR = Path(__file__).resolve().parent / "uploads"
+# アップロード中・変換中のファイルを置く場所 (配信・掃除の対象外)
+STAGING_DIR = UPLOAD_DIR / ".incoming"
+URL_PREFIX = "/static/"
+HASH_CHUNK_SIZE = 1024 * 1024
+_SUFFIX_PATTERN = re.compile(r"^\.[a-z0-9]{1,8}$")
+_CONTENT_KEY_PATTERN = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]{1,8})?$")
+# 内容のハッシュが名前のファイルは中身が変わらないので、ブラウザに再検証なしで使い続けさせる
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# 以前のフラットな名前 (/static/<uuid>.jpg, /static/thumbs/...) は短めにして再検証させる
+LEGACY_CACHE_CONTROL = "private, max-age=3600"
+# 設定するとファイルの送信を nginx に任せる (X-Accel-Redirect の内部ロケーション。例: /_uploads/)
+STATIC_ACCEL_REDIRECT = os.getenv("STATIC_ACCEL_REDIRECT", "")
+
+def safe_suffix(filename: str | None) -> str:
+    suffix = os.path.splitext(filename or "")[1].lower()
+    return suffix if _SUFFIX_PATTERN.match(suffix) else ""
+
+def content_key(digest: str, suffix: str) -> str:
+    # 1ディレクトリのファイル数が増えすぎないよう、ダイジェストの先頭4文字で2階層に分ける
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{suffix}"
+
+def to_path(key: str) -> str:
+    return f"{URL_PREFIX}{key}"
+
+def to_key(path: str) -> str | None:
+    if not path.startswith(URL_PREFIX):
+        return None
+    key = path.removeprefix(URL_PREFIX)
+    # ".." などで保存先の外を指すものは扱わない
+    if any(part in ("", ".", "..") for part in key.split("/")):
+        return None
+    return key
+
+def _file_digest(src: Path) -> str:
+    digest = hashlib.sha256()
+    with open(src, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def new_staging_file(suffix: str = "") -> Path:
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(suffix=suffix, dir=STAGING_DIR)
+    os.close(fd)
+    return Path(name)
+
+def clean_staging(modified_before: float) -> int:
+    # 途中で落ちたリクエストが残したステージングファイルを消す
+    removed = 0
+    for file in STAGING_DIR.glob("*"):
+        try:
+            if file.stat().st_mtime < modified_before:
+                file.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+class LocalStorage:
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, path: str) -> Path:
+        key = to_key(path)
+        if key is None:
+            raise FileNotFoundError(path)
+        return self.root / key
+
+    def put_file(self, src: Path, suffix: str) -> str:
+        # src (ステージングのファイル) は保存先へ移動する。同じ内容が保存済みなら src を消して既存のものを使う
+        path = to_path(content_key(_file_digest(src), suffix))
+        dest = self._file(path)
+        if dest.exists():
+            src.unlink(missing_ok=True)
+            # 削除・掃除の猶予期間に入れるため更新日時を進めておく
+            os.utime(dest)
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(src, 0o644)
+            os.replace(src, dest)
+        return path
+
+    def put_bytes(self, data: bytes, suffix: str) -> str:
+        src = new_staging_file(suffix)
+        src.write_bytes(data)
+        return self.put_file(src, suffix)
+
+    def open(self, path: str) -> BinaryIO:
+        return open(self._file(path), "rb")
+
+    def delete(self, path: str, modified_before: float | None = None):
+        try:
+            target = self._file(path)
+            if modified_before is None or target.stat().st_mtime < modified_before:
+                target.unlink()
+        except FileNotFoundError:
+            pass
+
+    def iter_files(self) -> Iterator[tuple[str, float]]:
+        for file in self.root.rglob("*"):
+            relative = file.relative_to(self.root)
+            if any(part.startswith(".") for part in relative.parts):
+                continue
+            try:
+                if file.is_file():
+                    yield to_path(relative.as_posix()), file.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+    def static_app(self):
+        return ProofImageFiles(directory=self.root, accel_redirect=STATIC_ACCEL_REDIRECT)
+
+class ProofImageFiles(StaticFiles):
+    """
+    /static の配信。StaticFiles に証拠画像向けのキャッシュヘッダーを足したものです。
+    内容のハッシュが名前のファイルにはダイジェストをそのまま ETag にして immutable で返します。
+    Range と If-None-Match / If-Modified-Since (304) は FileResponse / StaticFiles の処理をそのまま使います。
+    accel_redirect を指定すると本文を送らず X-Accel-Redirect を返し、送信は nginx が行います
+    (uvicorn のワーカーを画像の送信に使わない。設定例は nginx/homequest.conf.example)。
+    """
+    def __init__(self, directory: Path, accel_redirect: str = ""):
+        super().__init__(directory=directory)
+        self.accel_redirect = accel_redirect
+
+    async def get_response(self, path: str, scope) -> Response:
+        # ステージング (.incoming) など隠しファイルは配信しない
+        if any(part.startswith(".") for part in Path(path).parts):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        key = Path(self.get_path(scope)).as_posix()
+        match = _CONTENT_KEY_PATTERN.match(key)
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL if match else LEGACY_CACHE_CONTROL}
+        if match:
+            headers["ETag"] = f'"{match.group(1)}"'
+        if self.accel_redirect:
+            # 存在確認までをアプリで行い、Range や 304 を含めた送信は nginx (sendfile) に任せる
+            headers["X-Accel-Redirect"] = f"{self.accel_redirect}{quote(key)}"
+            headers["Content-Type"] = mimetypes.guess_type(key)[0] or "application/octet-stream"
+            return Response(status_code=status_code, headers=headers)
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+class S3Storage:
+    """
+    S3 互換ストレージ。boto3 は STORAGE_BACKEND=s3 の場合にだけ必要です。
+    presign_endpoint_url にはブラウザから届くエンドポイントを指定します (コンテナ内の http://minio:9000 とは別)。
+    """
+    def __init__(self, bucket: str, endpoint_url: str | None, presign_endpoint_url: str | None, region: str | None, presign_ttl: int):
+        import boto3
+        from botocore.exceptions import ClientError
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.presign_ttl = presign_ttl
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.presign_client = (
+            boto3.client("s3", endpoint_url=presign_endpoint_url, region_name=region)
+            if presign_endpoint_url else self.client
+        )
+        self._ensure_bucket()
+
+    def _not_found(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NoSuchBucket")
+
+    def _ensure_bucket(self):
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except self._client_error as e:
+            if not self._not_found(e):
+                raise
+            # MinIO などの検証環境向け。本番では権限を絞ってバケットを事前に作成しておく
+            self.client.create_bucket(Bucket=self.bucket)
+
+    def _last_modified(self, key: str) -> float | None:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except self._client_error as e:
+            if self._not_found(e):
+                return None
+            raise
+        return head["LastModified"].timestamp()
+
+    def _put(self, key: str, body: BinaryIO):
+        if self._last_modified(key) is not None:
+            # 保存済みの内容。自分自身へのコピーで更新日時を進め、削除・掃除の猶予期間に入れる
+            self.client.copy_object(
+                Bucket=self.bucket, Key=key, CopySource={"Bucket": self.bucket, "Key": key},
+                MetadataDirective="REPLACE", ContentType=self._content_type(key), CacheControl=IMMUTABLE_CACHE_CONTROL
+            )
+            return
+        self.client.upload_fileobj(
+            body, self.bucket, key,
+            ExtraArgs={"ContentType": self._content_type(key), "CacheControl": IMMUTABLE_CACHE_CONTROL}
+        )
+
+    @staticmethod
+    def _content_type(key: str) -> str:
+        return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+    def put_file(self, src: Path, suffix: str) -> str:
+        key = content_key(_file_digest(src), suffix)
+        try:
+            with open(src, "rb") as body:
+                self._put(key, body)
+        finally:
+            src.unlink(missing_ok=True)
+        return to_path(key)
+
+    def put_bytes(self, data: bytes, suffix: str) -> str:
+        key = content_key(hashlib.sha256(data).hexdigest(), suffix)
+        self._put(key, BytesIO(data))
+        return to_path(key)
+
+    def open(self, path: str) -> BinaryIO:
+        key = to_key(path)
+        if key is None:
+            raise FileNotFoundError(path)
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self._client_error as e:
+            if self._not_found(e):
+                raise FileNotFoundError(path) from e
+            raise
+        return BytesIO(obj["Body"].read())
+
+    def delete(self, path: str, modified_before: float | None = None):
+        key = to_key(path)
+        if key is None:
+            return
+        if modified_before is not None:
+            last_modified = self._last_modified(key)
+            if last_modified is None or last_modified >= modified_before:
+                return
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def iter_files(self) -> Iterator[tuple[str, float]]:
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket):
+            for obj in page.get("Contents", ()):
+                yield to_path(obj["Key"]), obj["LastModified"].timestamp()
+
+    async def _redirect(self, request):
+        key = to_key(f"{URL_PREFIX}{request.path_params['key']}")
+        if key is None:
+            return Response(status_code=404)
+        url = self.presign_client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=self.presign_ttl
+        )
+        # 署名付き URL が有効な間はリダイレクトもキャッシュさせ、同じ URL (= ブラウザのキャッシュ) を使い回させる
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": f"private, max-age={self.presign_ttl // 2}"})
+
+    def static_app(self):
+        # /static/<key> は API キー不要のまま、ストレージの署名付き URL へ転送する
+        return Starlette(routes=[Route("/{key:path}", self._redirect)])
+
+def _create_backend():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(
+            bucket=os.getenv("S3_BUCKET", "homequest"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+            presign_endpoint_url=os.getenv("S3_PUBLIC_ENDPOINT_URL") or None,
+            region=os.getenv("S3_REGION") or None,
+            presign_ttl=int(os.getenv("S3_PRESIGN_TTL", "3600")),
+        )
+    return LocalStorage(UPLOAD_DIR)
+
+backend = _create_backend()
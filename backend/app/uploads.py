@@ -0,0 +1,89 @@
+import os, json
+from pathlib import Path
+from typing import BinaryIO
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+class UploadTooLarge(Exception):
+    pass
+
+def save_upload(src: BinaryIO, dest: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> bool:
+    # スレッドプールから呼び出す想定。上限を超えたら書きかけのファイルを消して False を返す
+    written = 0
+    with open(dest, "wb") as buffer:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            written += len(chunk)
+            if written > max_bytes:
+                break
+            buffer.write(chunk)
+        else:
+            return True
+    dest.unlink(missing_ok=True)
+    return False
+
+class UploadSizeLimitMiddleware:
+    """
+    証拠画像アップロード (POST /quests/{quest_id}/complete) のリクエストボディを
+    受信しながら数え、MAX_UPLOAD_BYTES を超えた時点で 413 を返す ASGI ミドルウェア。
+    巨大なファイルがマルチパート解析で一時ファイルに書き出される前に打ち切ります。
+    """
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _is_upload(scope) -> bool:
+        return (
+            scope["type"] == "http"
+            and scope["method"] == "POST"
+            and scope["path"].startswith("/quests/")
+            and scope["path"].endswith("/complete")
+        )
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"File too large (Max: {self.max_bytes} bytes)"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if not self._is_upload(scope):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # 上限超過後にアプリが返すエラー応答 (ボディ解析失敗の 400 など) は捨てる
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if exceeded:
+            await self._reject(send)
@@ -0,0 +1,94 @@
+"""
+バックグラウンドジョブのワーカー
+
+    python worker.py                        # ジョブを処理し続ける (UPLOAD_SWEEP_INTERVAL ごとに uploads/ を掃除)
+    python worker.py --once                 # 溜まっているジョブと掃除を1回だけ実行して終了
+    python worker.py --sweep-interval 0     # 掃除をしない
+
+jobs テーブルから FOR UPDATE SKIP LOCKED で取り出すので、複数起動しても同じジョブを二重に処理しません。
+掃除では quest_completion_logs から参照されていない保存済みファイル (storage.py の保存先) を削除します。
+アップロード直後 (ログのコミット前や画像の変換中) のファイルを消さないよう、
+更新から UPLOAD_SWEEP_GRACE 秒以内のファイルは対象外です。
+"""
+import argparse, os, time, crud, storage
+from database import SessionLocal
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "50"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+UPLOAD_SWEEP_INTERVAL = int(os.getenv("UPLOAD_SWEEP_INTERVAL", "3600"))
+UPLOAD_SWEEP_GRACE = int(os.getenv("UPLOAD_SWEEP_GRACE", "3600"))
+# 同じ内容の再アップロード (保存済みファイルの共有) がコミットされる前に消さないための猶予
+DELETE_GRACE = 300
+
+def delete_files(db, paths: list[str]):
+    # 同じ内容のファイルは複数のログから共有されるので、まだ参照されているものは消さない
+    # 猶予期間内で消さなかったファイルは、参照されないままなら後の掃除で消える
+    referenced = crud.get_referenced_upload_paths(db, paths)
+    modified_before = time.time() - DELETE_GRACE
+    for path in paths:
+        if path not in referenced:
+            storage.backend.delete(path, modified_before=modified_before)
+
+HANDLERS = {
+    "delete_files": delete_files,
+}
+
+def run_jobs() -> int:
+    # 1バッチ分を処理して件数を返す。成功したジョブは削除し、失敗したものは間隔を空けて再試行する
+    with SessionLocal() as db:
+        jobs = crud.claim_jobs(db, JOB_BATCH_SIZE)
+        for job in jobs:
+            handler = HANDLERS.get(job.kind)
+            try:
+                if handler is None:
+                    raise ValueError(f"unknown job kind: {job.kind}")
+                handler(db, **job.payload)
+            except Exception as e:
+                print(f"[WARN] Job {job.id} ({job.kind}) failed: {e}")
+                crud.fail_job(db, job, str(e), JOB_MAX_ATTEMPTS)
+            else:
+                db.delete(job)
+        db.commit()
+    return len(jobs)
+
+def sweep_uploads() -> int:
+    with SessionLocal() as db:
+        referenced = crud.get_referenced_upload_paths(db)
+    cutoff = time.time() - UPLOAD_SWEEP_GRACE
+    removed = storage.clean_staging(cutoff)
+    for path, modified_at in storage.backend.iter_files():
+        if path in referenced or modified_at >= cutoff:
+            continue
+        # 一覧を取った後に同じ内容が再アップロードされた場合に備え、削除直前にも更新日時を確かめる
+        storage.backend.delete(path, modified_before=cutoff)
+        removed += 1
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] swept uploads: {removed} orphaned file(s) removed")
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true")
+    parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL, help="秒。ジョブがないときの待ち時間")
+    parser.add_argument("--sweep-interval", type=int, default=UPLOAD_SWEEP_INTERVAL, help="秒。0 なら掃除しない")
+    args = parser.parse_args()
+
+    next_sweep = time.monotonic()
+    while True:
+        try:
+            while run_jobs() >= JOB_BATCH_SIZE:
+                pass
+            if args.sweep_interval > 0 and time.monotonic() >= next_sweep:
+                sweep_uploads()
+                next_sweep = time.monotonic() + args.sweep_interval
+        except Exception as e:
+            # DB の再起動中やテーブル作成前 (バックエンド起動前) は待って再試行する
+            print(f"[WARN] Worker iteration failed: {e}")
+            if args.once:
+                raise
+        if args.once:
+            return
+        time.sleep(args.poll_interval)
+
+if __name__ == "__main__":
+    main()
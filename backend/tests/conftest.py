@@ -0,0 +1,51 @@
+import os, sys, tempfile
+from pathlib import Path
+import pytest
+
+# テスト用DB。TEST_DATABASE_URL (使い捨ての PostgreSQL) がなければ一時ファイルの SQLite を使う
+# テストごとにテーブルを作り直すので本番DBは指定しないこと
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or f"sqlite:///{Path(tempfile.mkdtemp()) / 'homequest_test.db'}"
+# 同時購入テストで並列に接続できるように
+os.environ.setdefault("DB_MAX_OVERFLOW", "50")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+import models
+from sqlalchemy import event
+from database import Base, engine, SessionLocal
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _enable_foreign_keys(dbapi_connection, _):
+        # PostgreSQL と同じく外部キー制約を効かせる
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def make_group(db):
+    # オーナー1人 + members 人のグループを作って (group, owner) を返す
+    def make(members: int = 0, points: int = 0):
+        owner = models.User(user_name="owner", password="x", is_first_login=False)
+        db.add(owner)
+        db.flush()
+        group = models.Group(group_name="group", owner_user_id=owner.id)
+        db.add(group)
+        db.flush()
+        db.add(models.UserGroup(user_id=owner.id, group_id=group.id, points=points, is_host=True))
+        for i in range(members):
+            user = models.User(user_name=f"member{i}", password="x", is_first_login=False)
+            db.add(user)
+            db.flush()
+            db.add(models.UserGroup(user_id=user.id, group_id=group.id, points=points, is_host=False))
+        db.commit()
+        return group, owner
+    return make
@@ -0,0 +1,23 @@
+import crud
+from sqlalchemy import event
+from database import engine
+
+def _count_queries(func, *args):
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = func(*args)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return result, len(statements)
+
+def test_group_detail_query_count_does_not_grow_with_members(db, make_group):
+    counts = {}
+    for members in (1, 10, 50):
+        group, _ = make_group(members)
+        db.expire_all()
+        detail, counts[members] = _count_queries(crud.get_group_detail, db, group.id)
+        assert len(detail["users"]) == members + 1
+    assert len(set(counts.values())) == 1, counts
@@ -0,0 +1,41 @@
+import crud, models
+from database import engine
+
+def _unique_index():
+    return next(ix for ix in models.UserGroup.__table__.indexes if ix.name == "ux_user_groups_user_group")
+
+def test_dedupe_memberships_allows_creating_unique_index(db, make_group):
+    group, owner = make_group(1)
+    member = db.query(models.UserGroup).filter(models.UserGroup.user_id != owner.id).one()
+    # 一意インデックス導入前のDB (重複した参加行がある状態) を再現する
+    _unique_index().drop(bind=engine)
+    db.add(models.UserGroup(user_id=member_user_id, group_id=group_id, points=0, is_host=True))
+    db.add(models.UserGroup(user_id=member_user_id, group_id=group_id, points=0, is_host=False))
+    db.commit()
+
+    crud.dedupe_memberships(db)
+    _unique_index().create(bind=engine)
+
+    db.expire_all()
+    rows = db.query(models.UserGroup).filter(models.UserGroup.user_id == member_user_id).all()
+    assert [row.id for row in rows] == [member_id]
+    assert rows[0].is_host
+    assert db.query(models.UserGroup).filter(models.UserGroup.group_id == group_id).count() == 2
+
+def test_join_race_returns_already_joined(db, make_group, monkeypatch):
+    group, _ = make_group()
+    group.invite_code = "ABCD1234"
+    user = models.User(user_name="joiner", password="x", is_first_login=False)
+    db.add(user)
+    db.commit()
+    assert crud.join_group_by_code(db, user.id, "ABCD1234")[1] == "成功"
+
+    # 既存チェックをすり抜けた2回目の参加 (同時リクエスト) は一意インデックスで弾かれる
+    real_query = db.query
+    def query_without_existing_member(*entities):
+        query = real_query(*entities)
+        if entities == (models.UserGroup,):
+            query = query.filter(models.UserGroup.id.is_(None))
+        return query
+    monkeypatch.setattr(db, "query", query_without_existing_member)
+    assert crud.join_group_by_code(db, user.id, "ABCD1234")[1] == "すでにこのグループに参加しています"
@@ -0,0 +1,51 @@
+import crud, models
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func
+from database import engine, SessionLocal
+
+# 残高チェックと減算・購入カウンターの条件付き UPSERT が、並列購入でも厳密に正しいかを確かめる
+pytestmark = pytest.mark.skipif(
+    engine.dialect.name != "postgresql",
+    reason="同時購入の検証には TEST_DATABASE_URL (PostgreSQL) が必要"
+)
+
+PURCHASES = 300
+CONCURRENCY = 50
+POINTS = 2500
+COST = 10
+
+def _purchase(user_id: int, item_id: int) -> bool:
+    with SessionLocal() as db:
+        remaining, _ = crud.purchase_item(db, user_id, item_id)
+        return remaining is not None
+
+@pytest.mark.parametrize("limit", [200, None])
+def test_parallel_purchases_keep_balance_counter_and_ledger_exact(db, make_group, limit):
+    group, owner = make_group(points=POINTS)
+    db.add(models.PointsLedger(
+        user_id=owner.id, group_id=group.id, delta=POINTS, balance_after=POINTS, reason="opening_balance"
+    ))
+    item = models.Shop(group_id=group.id, item_name="race item", cost_points=COST, limit_per_user=limit)
+    db.add(item)
+    db.commit()
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        results = list(pool.map(lambda _: _purchase(owner.id, item.id), range(PURCHASES)))
+
+    expected = min(PURCHASES, POINTS // COST, limit or PURCHASES)
+    assert sum(results) == expected
+    db.expire_all()
+    balance = db.query(models.UserGroup.points).filter(
+        models.UserGroup.user_id == owner.id, models.UserGroup.group_id == group.id
+    ).scalar()
+    assert balance == POINTS - COST * expected
+    assert db.query(models.PurchaseHistory).filter(models.PurchaseHistory.shop_item_id == item.id).count() == expected
+    counter = db.query(models.PurchaseCounter.purchase_count).filter(
+        models.PurchaseCounter.user_id == owner.id, models.PurchaseCounter.shop_item_id == item.id
+    ).scalar()
+    assert counter == (expected if limit is not None else None)
+    ledger_total = db.query(func.sum(models.PointsLedger.delta)).filter(
+        models.PointsLedger.user_id == owner.id, models.PointsLedger.group_id == group.id
+    ).scalar()
+    assert ledger_total == balance
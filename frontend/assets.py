@@ -0,0 +1,87 @@
+import hashlib, os, threading
+from pathlib import Path
+from typing import Dict, Optional
+from PIL import Image
+
+# 背景画像のアセットパイプライン
+# static/images/ の元画像から幅ごとの WebP をあらかじめ作り、ファイル名に内容のハッシュを付けて
+# static/build/ に置く。Streamlit の静的配信 (enableStaticServing) で app/static/build/... として配信される。
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+SOURCE_DIR = STATIC_DIR / "images"
+BUILD_DIR = STATIC_DIR / "build"
+STATIC_URL = "app/static/build"
+VARIANT_WIDTHS = tuple(int(w) for w in os.getenv("ASSET_VARIANT_WIDTHS", "800,1280,1920").split(","))
+WEBP_QUALITY = int(os.getenv("ASSET_WEBP_QUALITY", "80"))
+SOURCE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+
+_manifest: Dict[str, Dict[int, str]] = {}
+_lock = threading.Lock()
+
+def _digest(src: Path) -> str:
+    # 元画像と変換設定が同じなら同じ名前になる (変わればURLも変わる)
+    h = hashlib.sha256(src.read_bytes())
+    h.update(f"{VARIANT_WIDTHS}:{WEBP_QUALITY}".encode())
+    return h.hexdigest()[:12]
+
+def _build(src: Path) -> Dict[int, str]:
+    BUILD_DIR.mkdir(parents=True, exist_ok=True)
+    digest = _digest(src)
+    variants = {}
+    with Image.open(src) as img:
+        img = img.convert("RGB")
+        for width in sorted(set(VARIANT_WIDTHS)):
+            # 元画像より大きくは拡大しない
+            target = min(width, img.width)
+            out = BUILD_DIR / f"{src.stem}.{target}.{digest}.webp"
+            if not out.exists():
+                resized = img.resize((target, round(img.height * target / img.width)), Image.Resampling.LANCZOS)
+                tmp = out.with_suffix(".tmp")
+                resized.save(tmp, "WEBP", quality=WEBP_QUALITY, method=6)
+                os.replace(tmp, out)
+            variants[width] = out.name
+
+    # 以前のハッシュで作った古いファイルを掃除する
+    current = set(variants.values())
+    for old in BUILD_DIR.glob(f"{src.stem}.*.webp"):
+        if old.name not in current:
+            old.unlink(missing_ok=True)
+    return {width: f"{STATIC_URL}/{name}" for width, name in variants.items()}
+
+def build_all() -> Dict[str, Dict[int, str]]:
+    # 起動時に一度だけ呼ぶ (main.py で st.cache_resource 経由)
+    for src in sorted(SOURCE_DIR.iterdir()):
+        if src.suffix.lower() in SOURCE_SUFFIXES:
+            variant_urls(src.name)
+    return dict(_manifest)
+
+def variant_urls(name: str) -> Optional[Dict[int, str]]:
+    src = SOURCE_DIR / name
+    with _lock:
+        if name not in _manifest:
+            if not src.exists():
+                return None
+            try:
+                _manifest[name] = _build(src)
+            except OSError as e:
+                print(f"[WARN] Failed to build asset {name}: {e}")
+                return None
+        return _manifest[name]
+
+def background_rules(selector: str, name: str, fallback: str) -> str:
+    """
+    selector の背景に name の画像を当てる CSS を返す。
+    画面幅に応じて小さい順に上書きするので、狭い画面では小さいファイルだけが読み込まれる。
+    画像がない場合は fallback の背景色だけを返す。
+    """
+    urls = variant_urls(name)
+    if not urls:
+        return f"{selector} {{ background-color: {fallback}; }}"
+    widths = sorted(urls)
+    rules = [f"{selector} {{ background-color: {fallback}; background-image: url('{urls[widths[0]]}'); }}"]
+    for smaller, width in zip(widths, widths[1:]):
+        # 元画像が小さく同じファイルになった幅は省く
+        if urls[width] != urls[smaller]:
+            rules.append(
+                f"@media (min-width: {smaller + 1}px) {{ {selector} {{ background-image: url('{urls[width]}'); }} }}"
+            )
+    return "\n".join(rules)
@@ -1,5 +1,131 @@
-import requests
-from typing import Optional, Dict, Any
+import os, re, copy, threading, time, tempfile, requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional, Dict, Any, Callable, Iterable, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+EXPORT_SPOOL_BYTES = 4 * 1024 * 1024
+
+# --- 通信設定 (秒) ---
+CONNECT_TIMEOUT = float(os.getenv("HQ_API_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("HQ_API_READ_TIMEOUT", "15"))
+# 画像アップロードやエクスポートなど時間のかかる呼び出し用
+SLOW_READ_TIMEOUT = float(os.getenv("HQ_API_SLOW_READ_TIMEOUT", "120"))
+POOL_SIZE = int(os.getenv("HQ_API_POOL_SIZE", "20"))
+GET_RETRIES = int(os.getenv("HQ_API_GET_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("HQ_API_RETRY_BACKOFF", "0.3"))
+SLOW_CALL_MS = float(os.getenv("HQ_API_SLOW_CALL_MS", "1000"))
+FANOUT_WORKERS = int(os.getenv("HQ_API_FANOUT_WORKERS", "8"))
+
+# --- レスポンスキャッシュ (ユーザー = HomeQuestAPI インスタンスごと) ---
+CACHE_ENABLED = os.getenv("HQ_API_CACHE", "true").lower() == "true"
+# エンドポイントごとの TTL (秒)。期限切れ後は ETag で再検証し、変わっていなければ本文を受け取らずに延長する
+CACHE_TTLS = {
+    "GET /users/me": 60,
+    "GET /users/{id}/groups": 30,
+    "GET /groups/{id}": 15,
+    "GET /users/me/quest_board": 10,
+    "GET /users/me/shop": 10,
+}
+
+_session = None
+_session_lock = threading.Lock()
+_fanout_executor = None
+
+def _shared_session() -> requests.Session:
+    # 全 Streamlit セッションで共有するコネクションプール (ヘッダーは呼び出しごとに渡すので共有しても混ざらない)
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=GET_RETRIES,
+                connect=GET_RETRIES,
+                read=GET_RETRIES,
+                status=GET_RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                status_forcelist=[502, 503, 504],
+                # 冪等な GET / HEAD だけを再送する (POST などは接続確立前の失敗のみ)
+                allowed_methods=["GET", "HEAD"],
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def _fanout_pool() -> ThreadPoolExecutor:
+    # gather / fan_out 用のワーカー (プロセス内で共有。接続数は POOL_SIZE 以下に抑える)
+    global _fanout_executor
+    with _session_lock:
+        if _fanout_executor is None:
+            _fanout_executor = ThreadPoolExecutor(
+                max_workers=min(FANOUT_WORKERS, POOL_SIZE), thread_name_prefix="hq-api"
+            )
+        return _fanout_executor
+
+class LatencyStats:
+    """エンドポイントごとの呼び出し回数・エラー数・レイテンシ (直近 window 件) の集計"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {"count": 0, "errors": 0, "samples": deque(maxlen=self.window)})
+            stats["count"] += 1
+            if not ok:
+                stats["errors"] += 1
+            stats["samples"].append(seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for endpoint, stats in self._stats.items():
+                samples = sorted(stats["samples"])
+                result[endpoint] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "p50_ms": round(samples[len(samples) // 2] * 1000, 1) if samples else None,
+                    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1) if samples else None,
+                    "max_ms": round(samples[-1] * 1000, 1) if samples else None,
+                }
+            return result
+
+LATENCY = LatencyStats()
+
+class CacheStats:
+    """エンドポイントごとのキャッシュ hit / miss / revalidated (304) / invalidated の回数"""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, event: str):
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, {"hit": 0, "miss": 0, "revalidated": 0, "invalidated": 0})
+            counts[event] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._counts.items()}
+
+CACHE_STATS = CacheStats()
+
+# 更新系メソッドで破棄するキャッシュ (ラベル形式は該当するエンドポイントの全エントリが対象)
+GROUP_DETAIL = "/groups/{id}"
+QUEST_BOARD = "/users/me/quest_board"
+SHOP_OVERVIEW = "/users/me/shop"
+MEMBERSHIP_VIEWS = ["/users/{id}/groups", QUEST_BOARD, SHOP_OVERVIEW]
+
+def _endpoint(method: str, path: str) -> str:
+    # メトリクス・キャッシュ設定用のラベル (パス中の数値IDは {id} にまとめる)
+    return f"{method} {re.sub(r'/[0-9]+(?=/|$)', '/{id}', path)}"
 
 class HomeQuestAPI:
     def __init__(self, api_url: str, api_key: str, image_base_url: str = None):
@@ -7,6 +133,11 @@ class HomeQuestAPI:
         self.image_base_url = (image_base_url or api_url).rstrip("/")
         self.api_key = api_key
         self.token = None
+        self.session = _shared_session()
+        self._cache: Dict[Any, Dict[str, Any]] = {}
+        self._cache_lock = threading.Lock()
+        # 取得中に無効化された結果をキャッシュに書き戻さないための世代番号
+        self._cache_generation = 0
 
     def get_full_image_url(self, path: str) -> Optional[str]:
         if not path:
@@ -24,6 +155,100 @@ class HomeQuestAPI:
             headers["Content-Type"] = "application/json"
         return headers
 
+    @staticmethod
+    def _page_params(cursor: str = None, limit: int = None, since: str = None, until: str = None) -> Dict[str, Any]:
+        # 履歴系APIのページング条件 (cursor には前ページの next_cursor を渡す)
+        params = {"cursor": cursor, "limit": limit, "since": since, "until": until}
+        return {k: v for k, v in params.items() if v is not None}
+
+    def _request(self, method: str, path: str, read_timeout: float = READ_TIMEOUT, **kwargs) -> requests.Response:
+        # 共有セッション経由で送信し、エンドポイント (ID部分は {id} にまとめる) ごとのレイテンシを記録する
+        kwargs.setdefault("headers", self._get_headers())
+        endpoint = _endpoint(method, path)
+        started = time.perf_counter()
+        ok = False
+        try:
+            res = self.session.request(method, f"{self.api_url}{path}", timeout=(CONNECT_TIMEOUT, read_timeout), **kwargs)
+            ok = res.status_code < 500
+            return res
+        finally:
+            elapsed = time.perf_counter() - started
+            LATENCY.observe(endpoint, elapsed, ok)
+            if elapsed * 1000 >= SLOW_CALL_MS:
+                print(f"[SLOW] {endpoint} took {elapsed * 1000:.0f} ms")
+
+    def _call(self, method: str, path: str, **kwargs) -> Any:
+        try:
+            res = self._request(method, path, **kwargs)
+        except requests.exceptions.RequestException as e:
+            # タイムアウト・接続失敗 (リトライ後) もエラー辞書として返す
+            print(f"Connection Error: {e}")
+            return {"error": "Connection failed"}
+        return self._handle_response(res)
+
+    def _cached_get(self, path: str, params: Dict[str, Any] = None) -> Any:
+        # CACHE_TTLS に載っている GET だけをキャッシュする
+        endpoint = _endpoint("GET", path)
+        ttl = CACHE_TTLS.get(endpoint, 0) if CACHE_ENABLED else 0
+        if ttl <= 0:
+            return self._call("GET", path, params=params)
+
+        key = (path, tuple(sorted((params or {}).items())))
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            generation = self._cache_generation
+        if entry and entry["expires_at"] > time.monotonic():
+            CACHE_STATS.record(endpoint, "hit")
+            return copy.deepcopy(entry["data"])
+
+        headers = self._get_headers()
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        try:
+            res = self._request("GET", path, params=params, headers=headers)
+        except requests.exceptions.RequestException as e:
+            print(f"Connection Error: {e}")
+            return {"error": "Connection failed"}
+
+        if res.status_code == 304 and entry:
+            CACHE_STATS.record(endpoint, "revalidated")
+            data = entry["data"]
+        else:
+            CACHE_STATS.record(endpoint, "miss")
+            data = self._handle_response(res)
+            if not res.ok:
+                return data
+        with self._cache_lock:
+            if generation == self._cache_generation:
+                self._cache[key] = {
+                    "data": data,
+                    "etag": res.headers.get("ETag") or (entry and entry["etag"]),
+                    "expires_at": time.monotonic() + ttl,
+                    "endpoint": endpoint,
+                }
+        return copy.deepcopy(data)
+
+    def invalidate(self, *targets: str):
+        """
+        キャッシュを破棄する。target は実パス ("/groups/3") かラベル形式 ("/groups/{id}")。
+        何も渡さなければ全件を破棄する。
+        """
+        with self._cache_lock:
+            self._cache_generation += 1
+            for key in list(self._cache):
+                entry = self._cache[key]
+                if not targets or any(key[0] == t or entry["endpoint"] == f"GET {t}" for t in targets):
+                    del self._cache[key]
+                    CACHE_STATS.record(entry["endpoint"], "invalidated")
+
+    def _mutate(self, method: str, path: str, invalidate: Iterable[str] = (), **kwargs) -> Any:
+        # 更新系の呼び出し。成否にかかわらず影響するキャッシュを破棄する
+        try:
+            return self._call(method, path, **kwargs)
+        finally:
+            if invalidate:
+                self.invalidate(*invalidate)
+
     def _handle_response(self, response: requests.Response) -> Any:
         try:
             response.raise_for_status()
@@ -38,95 +263,93 @@ class HomeQuestAPI:
             print(f"Connection Error: {e}")
             return {"error": "Connection failed"}
 
+    def latency_report(self) -> Dict[str, Dict[str, Any]]:
+        return LATENCY.snapshot()
+
+    def cache_report(self) -> Dict[str, Dict[str, int]]:
+        return CACHE_STATS.snapshot()
+
+    # --- 並列呼び出し ---
+
+    def gather(self, *calls: Callable[[], Any]) -> List[Any]:
+        """
+        互いに依存しない API 呼び出しを並列に実行し、渡した順に結果を返す。
+            detail, me = api.gather(lambda: api.get_group_detail(gid), api.get_me)
+        ワーカースレッドから st.* は呼べないので、渡すのは API メソッドだけにすること。
+        """
+        if len(calls) <= 1:
+            return [call() for call in calls]
+        futures = [_fanout_pool().submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+    def fan_out(self, method: Callable[[Any], Any], items: Iterable[Any]) -> List[Any]:
+        # 例: api.fan_out(api.get_my_submissions, group_ids) -> group_ids と同じ順の結果リスト
+        return self.gather(*(partial(method, item) for item in items))
+
     # --- 認証・ユーザー関連 ---
 
     def health_check(self):
-        res = requests.get(f"{self.api_url}/", headers=self._get_headers())
-        return self._handle_response(res)
+        return self._call("GET", "/")
 
     def signup(self, user_name, password):
         payload = {"user_name": user_name, "password": password}
-        res = requests.post(f"{self.api_url}/users", json=payload, headers=self._get_headers())
-        return self._handle_response(res)
+        return self._call("POST", "/users", json=payload)
 
     def login(self, user_id, password):
         data = {"username": str(user_id), "password": password}
-        headers = {"X-App-Key": self.api_key} 
-        res = requests.post(f"{self.api_url}/token", data=data, headers=headers)
-        
-        result = self._handle_response(res)
-        
+        headers = {"X-App-Key": self.api_key}
+        result = self._call("POST", "/token", data=data, headers=headers)
+
         if result and "access_token" in result:
             self.token = result["access_token"]
+            # 別ユーザーでログインし直した場合に前のユーザーのデータを返さない
+            self.invalidate()
             return result
         return None
 
     def get_me(self):
-        res = requests.get(f"{self.api_url}/users/me", headers=self._get_headers())
-        return self._handle_response(res)
+        return self._cached_get("/users/me")
 
-    def get_my_groups(self, user_id: int):
-        res = requests.get(f"{self.api_url}/users/{user_id}/groups", headers=self._get_headers())
-        return self._handle_response(res)
+    def get_my_groups(self, user_id: int, include: str = None):
+        # include: "shops,quests,counts" のように必要なものだけ指定する (既定は id / 名前のみ)
+        return self._cached_get(f"/users/{user_id}/groups", params={"include": include} if include else None)
 
-    def get_my_purchases(self):
-        res = requests.get(f"{self.api_url}/users/me/purchases", headers=self._get_headers())
-        return self._handle_response(res)
+    def get_my_purchases(self, cursor: str = None, limit: int = None):
+        return self._call("GET", "/users/me/purchases", params=self._page_params(cursor, limit))
 
     # --- グループ管理 ---
 
     def create_group(self, group_name: str):
-        res = requests.post(
-            f"{self.api_url}/groups", 
-            json={"group_name": group_name}, 
-            headers=self._get_headers()
-        )
-        return self._handle_response(res)
+        return self._mutate("POST", "/groups", MEMBERSHIP_VIEWS, json={"group_name": group_name})
 
     def get_group_detail(self, group_id: int):
-        res = requests.get(f"{self.api_url}/groups/{group_id}", headers=self._get_headers())
-        return self._handle_response(res)
+        return self._cached_get(f"/groups/{group_id}")
 
     def generate_invite_code(self, group_id: int):
-        res = requests.post(f"{self.api_url}/groups/{group_id}/invite_code", headers=self._get_headers())
-        return self._handle_response(res)
-    
+        return self._mutate("POST", f"/groups/{group_id}/invite_code", [f"/groups/{group_id}"])
+
     def reset_invite_code(self, group_id: int):
-        res = requests.post(f"{self.api_url}/groups/{group_id}/reset_invite_code", headers=self._get_headers())
-        return self._handle_response(res)
+        return self._mutate("POST", f"/groups/{group_id}/reset_invite_code", [f"/groups/{group_id}"])
 
     def join_group(self, invite_code: str):
-        res = requests.post(
-            f"{self.api_url}/groups/join", 
-            json={"invite_code": invite_code}, 
-            headers=self._get_headers()
-        )
-        return self._handle_response(res)
+        # 参加すると初回ログインフラグも変わるので /users/me も破棄する
+        return self._mutate("POST", "/groups/join", MEMBERSHIP_VIEWS + ["/users/me"], json={"invite_code": invite_code})
 
     def update_member_role(self, group_id: int, target_user_id: int, is_host: bool):
-        res = requests.put(
-            f"{self.api_url}/groups/{group_id}/members/{target_user_id}/role",
-            json={"is_host": is_host},
-            headers=self._get_headers()
+        return self._mutate(
+            "PUT", f"/groups/{group_id}/members/{target_user_id}/role", [f"/groups/{group_id}"], json={"is_host": is_host}
         )
-        return self._handle_response(res)
 
     def kick_member(self, group_id: int, target_user_id: int):
-        res = requests.delete(
-            f"{self.api_url}/groups/{group_id}/members/{target_user_id}",
-            headers=self._get_headers()
-        )
-        return self._handle_response(res)
-    
+        return self._mutate("DELETE", f"/groups/{group_id}/members/{target_user_id}", [f"/groups/{group_id}"])
+
     def leave_group(self, group_id: int):
         if not self.token:
             return {"error": "Unauthorized"}
-            
+
         try:
-            resp = requests.post(
-                f"{self.api_url}/groups/{group_id}/leave",
-                headers=self._get_headers()
-            )
+            self.invalidate(f"/groups/{group_id}", *MEMBERSHIP_VIEWS)
+            resp = self._request("POST", f"/groups/{group_id}/leave")
             if resp.status_code == 200:
                 return resp.json()
             elif resp.status_code == 400:
@@ -135,10 +358,9 @@ class HomeQuestAPI:
                 return {"error": f"Failed to leave: {resp.text}"}
         except Exception as e:
             return {"error": str(e)}
-        
+
     def delete_group(self, group_id: int):
-        res = requests.delete(f"{self.api_url}/groups/{group_id}", headers=self._get_headers())
-        return self._handle_response(res)
+        return self._mutate("DELETE", f"/groups/{group_id}", [f"/groups/{group_id}", *MEMBERSHIP_VIEWS])
 
     # --- クエスト関連 ---
 
@@ -150,16 +372,11 @@ class HomeQuestAPI:
             "start_time": start_time,
             "end_time": end_time
         }
-        res = requests.post(
-            f"{self.api_url}/groups/{group_id}/quests", 
-            json=payload, 
-            headers=self._get_headers()
-        )
-        return self._handle_response(res)
+        return self._mutate("POST", f"/groups/{group_id}/quests", [f"/groups/{group_id}", QUEST_BOARD], json=payload)
 
     def delete_quest(self, quest_id: int):
-        res = requests.delete(f"{self.api_url}/quests/{quest_id}", headers=self._get_headers())
-        return self._handle_response(res)
+        # クエストからグループIDが分からないのでグループ詳細は全件破棄する
+        return self._mutate("DELETE", f"/quests/{quest_id}", [GROUP_DETAIL, QUEST_BOARD])
 
     def complete_quest(self, quest_id: int, uploaded_file):
         files = {
@@ -169,28 +386,22 @@ class HomeQuestAPI:
                 uploaded_file.type
             )
         }
-        res = requests.post(
-            f"{self.api_url}/quests/{quest_id}/complete",
+        return self._mutate(
+            "POST", f"/quests/{quest_id}/complete", [QUEST_BOARD],
             files=files,
-            headers=self._get_headers(multipart=True)
+            headers=self._get_headers(multipart=True),
+            read_timeout=SLOW_READ_TIMEOUT
         )
-        return self._handle_response(res)
 
     def get_pending_submissions(self, group_id: int):
-        res = requests.get(f"{self.api_url}/groups/{group_id}/submissions", headers=self._get_headers())
-        return self._handle_response(res)
+        return self._call("GET", f"/groups/{group_id}/submissions")
 
     def review_submission(self, log_id: int, approved: bool):
-        res = requests.post(
-            f"{self.api_url}/submissions/{log_id}/review",
-            json={"approved": approved},
-            headers=self._get_headers()
-        )
-        return self._handle_response(res)
-    
-    def get_quest_history(self, group_id: int):
-        res = requests.get(f"{self.api_url}/groups/{group_id}/history/quests", headers=self._get_headers())
-        return self._handle_response(res)
+        # 承認でメンバーのポイントが変わるのでグループ詳細も破棄する
+        return self._mutate("POST", f"/submissions/{log_id}/review", [QUEST_BOARD, GROUP_DETAIL], json={"approved": approved})
+
+    def get_quest_history(self, group_id: int, cursor: str = None, limit: int = None, since: str = None, until: str = None):
+        return self._call("GET", f"/groups/{group_id}/history/quests", params=self._page_params(cursor, limit, since, until))
 
     # --- ショップ関連 ---
 
@@ -201,36 +412,51 @@ class HomeQuestAPI:
             "description": description,
             "limit_per_user": limit_per_user
         }
-        res = requests.post(
-            f"{self.api_url}/groups/{group_id}/shops",
-            json=payload,
-            headers=self._get_headers()
-        )
-        return self._handle_response(res)
+        return self._mutate("POST", f"/groups/{group_id}/shops", [f"/groups/{group_id}", SHOP_OVERVIEW], json=payload)
 
     def delete_shop_item(self, item_id: int):
-        res = requests.delete(f"{self.api_url}/shops/{item_id}", headers=self._get_headers())
-        return self._handle_response(res)
+        return self._mutate("DELETE", f"/shops/{item_id}", [GROUP_DETAIL, SHOP_OVERVIEW])
 
     def purchase_item(self, item_id: int):
-        res = requests.post(f"{self.api_url}/shops/{item_id}/purchase", headers=self._get_headers())
-        return self._handle_response(res)
+        # 残高・残り購入回数が変わる (商品からグループIDが分からないのでグループ詳細は全件破棄する)
+        return self._mutate("POST", f"/shops/{item_id}/purchase", [GROUP_DETAIL, SHOP_OVERVIEW])
+
+    def get_purchase_history(self, group_id: int, cursor: str = None, limit: int = None, since: str = None, until: str = None):
+        return self._call("GET", f"/groups/{group_id}/history/purchases", params=self._page_params(cursor, limit, since, until))
+
+    def export_group_history(self, group_id: int, kind: str = "purchases", fmt: str = "csv"):
+        # 全履歴はストリーミングで受け取り、一定サイズを超えたら一時ファイルに逃がす
+        try:
+            with self._request(
+                "GET", f"/groups/{group_id}/history/{kind}/export",
+                params={"format": fmt},
+                stream=True,
+                read_timeout=SLOW_READ_TIMEOUT
+            ) as res:
+                if not res.ok:
+                    return self._handle_response(res)
+                spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+                for chunk in res.iter_content(chunk_size=64 * 1024):
+                    spool.write(chunk)
+                spool.seek(0)
+                return spool
+        except requests.exceptions.RequestException as e:
+            print(f"Connection Error: {e}")
+            return {"error": "Connection failed"}
+
+    def get_shop_overview(self):
+        # ショップ表示に必要なデータ (全グループ分) を1リクエストで取得する
+        return self._cached_get("/users/me/shop")
+
+    def get_quest_board(self):
+        # クエストボード表示に必要なデータ (全グループ分) を1リクエストで取得する
+        return self._cached_get("/users/me/quest_board")
 
-    def get_purchase_history(self, group_id: int):
-        res = requests.get(f"{self.api_url}/groups/{group_id}/history/purchases", headers=self._get_headers())
-        return self._handle_response(res)
-    
     def get_my_submissions(self, group_id: int):
-        res = requests.get(
-            f"{self.api_url}/groups/{group_id}/my_submissions",
-            headers=self._get_headers()
-        )
-        return self._handle_response(res)
+        return self._call("GET", f"/groups/{group_id}/my_submissions")
 
-    def get_my_purchase_history_all(self):
-        res = requests.get(f"{self.api_url}/users/me/history/purchases/all", headers=self._get_headers())
-        return self._handle_response(res)
+    def get_my_purchase_history_all(self, cursor: str = None, limit: int = None, since: str = None, until: str = None):
+        return self._call("GET", "/users/me/history/purchases/all", params=self._page_params(cursor, limit, since, until))
 
-    def get_my_quest_history_all(self):
-        res = requests.get(f"{self.api_url}/users/me/history/quests/all", headers=self._get_headers())
-        return self._handle_response(res)
\ No newline at end of file
+    def get_my_quest_history_all(self, cursor: str = None, limit: int = None, since: str = None, until: str = None):
+        return self._call("GET", "/users/me/history/quests/all", params=self._page_params(cursor, limit, since, until))
@@ -1,6 +1,7 @@
 import os
 import streamlit as st
 from hq_api import HomeQuestAPI
+import assets
 from views import home, groups, quests, shop, group_detail, quest_manage, shop_detail, quest_report, quest_review
 import const
 
@@ -12,6 +13,13 @@ API_URL = os.getenv("BACKEND_API_URL", "http://backend:8000")
 API_KEY = os.getenv("APP_API_KEY", "your_api_key")
 IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL", "http://localhost:8000")
 
+@st.cache_resource
+def build_assets():
+    # 背景画像のリサイズ・WebP 変換はサーバープロセスごとに一度だけ行う
+    return assets.build_all()
+
+build_assets()
+
 if "api" not in st.session_state:
     st.session_state.api = HomeQuestAPI(API_URL, API_KEY, IMAGE_BASE_URL)
 
@@ -77,6 +85,12 @@ def page_login_signup():
 
 # --- 3. メインルーティング ---
 def main():
+    # HQ_API_SHOW_LATENCY=true のとき、サイドバーにバックエンド呼び出しのレイテンシとキャッシュ状況を表示する
+    if os.getenv("HQ_API_SHOW_LATENCY", "false").lower() == "true":
+        with st.sidebar.expander("API latency"):
+            st.table(st.session_state.api.latency_report())
+            st.table(st.session_state.api.cache_report())
+
     if not st.session_state.is_logged_in:
         page_login_signup()
         return
@@ -15,9 +15,8 @@ def page_group_detail():
             st.rerun()
         return
 
-    # データ取得
-    group = api.get_group_detail(group_id)
-    me = api.get_me()
+    # データ取得（互いに依存しないので並列に取得）
+    group, me = api.gather(lambda: api.get_group_detail(group_id), api.get_me)
     
     if "error" in group or "error" in me:
         st.error("データの取得に失敗しました")
@@ -109,14 +108,24 @@ def page_group_detail():
         with tabs[1]:
             st.markdown("#### 🛒 メンバーの購入履歴")
             # APIから履歴を取得（バックエンドで作った GET /groups/{group_id}/history/purchases を叩く想定）
-            history_res = api.get_purchase_history(group_id)
+            # 履歴はページ単位 (next_cursor) で取得し、「さらに読み込む」で表示ページ数を増やす
+            pages_key = f"purchase_history_pages_{group_id}"
+            history_items, next_cursor = [], None
+            for _ in range(st.session_state.get(pages_key, 1)):
+                history_res = api.get_purchase_history(group_id, cursor=next_cursor)
+                if not history_res or "error" in history_res:
+                    break
+                history_items.extend(history_res.get("items", []))
+                next_cursor = history_res.get("next_cursor")
+                if not next_cursor:
+                    break
             
-            if not history_res or "error" in history_res:
+            if not history_items:
                 st.info("まだ購入履歴がありません。")
             else:
                 # テーブル形式でオシャレに表示
                 import pandas as pd
-                df = pd.DataFrame(history_res)
+                df = pd.DataFrame(history_items)
                 
                 # 表示用にカラム名を日本語に整える
                 df = df.rename(columns={
@@ -128,15 +137,23 @@ def page_group_detail():
                 
                 # 日時を見やすく整形（もし文字列なら）
                 st.dataframe(df[["購入者", "アイテム名", "消費ポイント", "日時"]], use_container_width=True)
+                if next_cursor and st.button("さらに読み込む", key=f"more_purchase_history_{group_id}"):
+                    st.session_state[pages_key] = st.session_state.get(pages_key, 1) + 1
+                    st.rerun()
                 
-                # UX向上：CSVダウンロード機能
-                csv = df.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 履歴をCSVでダウンロード",
-                    data=csv,
-                    file_name=f"group_{group_id}_purchase_history.csv",
-                    mime="text/csv",
-                )
+                # UX向上：ダウンロード機能（全履歴はバックエンドのエクスポートAPIからストリーミングで取得）
+                export_fmt = st.radio("形式", ["csv", "ndjson"], horizontal=True, key=f"export_fmt_{group_id}")
+                if st.button("📥 全履歴をダウンロード用に準備", key=f"export_purchase_history_{group_id}"):
+                    export = api.export_group_history(group_id, "purchases", export_fmt)
+                    if isinstance(export, dict) and "error" in export:
+                        st.error(export["error"])
+                    else:
+                        st.download_button(
+                            label="📥 ダウンロード",
+                            data=export.read(),
+                            file_name=f"group_{group_id}_purchase_history.{export_fmt}",
+                            mime="text/csv" if export_fmt == "csv" else "application/x-ndjson",
+                        )
 
         # -- C. 権限管理（オーナーのみ）--
         if is_owner:
@@ -1,25 +1,16 @@
 import streamlit as st
-import os
-import base64
+import assets
 
 def page_home():
-    # --- 画像のベース64変換関数 ---
-    def get_base64_img(path):
-        if os.path.exists(path):
-            with open(path, 'rb') as f:
-                return base64.b64encode(f.read()).decode()
-        return None
-
-    # 合成済みの背景画像を読み込み
-    bg_path = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'static', 'images', 'background.png'))
-    bg_b64 = get_base64_img(bg_path)
+    # 合成済みの背景画像（起動時に作ったリサイズ済み WebP を静的ファイルとして参照）
+    bg_rules = assets.background_rules(".stApp", "background.png", fallback="#2c2c2c")
 
     # --- CSSで要素の位置を強制固定 ---
     st.markdown(f"""
         <style>
         /* 画面全体の固定 */
+        {bg_rules}
         .stApp {{
-            background-image: url('data:image/png;base64,{bg_b64}');
             background-size: cover;
             background-position: center;
             height: 100vh;
@@ -22,13 +22,14 @@ def page_quest_report():
     # クエストボードと同じロジックで、既に提出済みでないか最終確認します
     with st.spinner("提出状況を確認中..."):
         # ユーザーが所属する全グループから、このクエストのログがあるか探す
-        # (APIの設計上、所属グループを回る必要があります)
+        # (グループごとの提出状況は並列に取得する)
         me = api.get_me()
         my_groups = api.get_my_groups(me["id"])
+        if not isinstance(my_groups, list):
+            my_groups = []
         
         already_submitted = False
-        for g in my_groups:
-            logs = api.get_my_submissions(g["id"])
+        for logs in api.fan_out(api.get_my_submissions, [g["id"] for g in my_groups]):
             if isinstance(logs, list):
                 if any(l["quest_id"] == quest_id and l["status"] in ["approved", "pending"] for l in logs):
                     already_submitted = True
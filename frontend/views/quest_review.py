@@ -1,4 +1,3 @@
-import os
 import time
 import streamlit as st
 import utils
@@ -58,18 +57,14 @@ def page_quest_review():
             elif "reward_points" in target_log:
                 reward_points = target_log.get("reward_points", 0)
 
-    # --- 画像表示ロジック (IMAGE_BASE_URL使用版) ---
+    # --- 画像表示ロジック (プレビューはサムネイル、元画像はリンクで開く) ---
     proof_path = target_log.get("proof_image_path")
+    thumbnail_path = target_log.get("thumbnail_path")
     if proof_path:
-        filename = os.path.basename(proof_path)
-        image_base_url = os.getenv("IMAGE_BASE_URL", "http://localhost:8000")
-        if image_base_url.endswith("/"):
-            image_base_url = image_base_url[:-1]
-            
-        image_url = f"{image_base_url}/static/{filename}"
-        
         st.write("▼ 証拠画像")
-        st.image(image_url, caption="提出された画像")
+        st.image(api.get_full_image_url(thumbnail_path or proof_path), caption="提出された画像")
+        if thumbnail_path:
+            st.markdown(f"[🔍 元のサイズで見る]({api.get_full_image_url(proof_path)})")
     else:
         st.warning("画像が見つかりません")
 
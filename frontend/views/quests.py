@@ -8,31 +8,24 @@ def page_quests():
     st.markdown('<div class="main-title"><h1>🛡️ クエストボード</h1></div>', unsafe_allow_html=True)
 
     api = st.session_state.api
-    me = api.get_me()
     
-    # 1. 参加グループを取得
-    my_groups = api.get_my_groups(me["id"])
-    if not my_groups or (isinstance(my_groups, dict) and "error" in my_groups):
+    # 1. 参加グループ・クエスト・提出状況・承認待ちをまとめて取得
+    board = api.get_quest_board()
+    if isinstance(board, dict) and "error" in board:
+        st.error(f"クエストボードを読み込めませんでした: {board['error']}")
+        return
+    my_groups = board.get("groups") if isinstance(board, dict) else None
+    if not my_groups:
         st.info("まだグループに参加していません")
         if st.button("🏠 ホームに戻る", key="back_home_top"):
             st.session_state.current_page = "home"
             st.rerun()
         return
 
-    # 2. ホスト権限判定
-    is_host = False
-    host_groups = {} 
-    for g in my_groups:
-        if g.get("owner_user_id") == me["id"]:
-            is_host = True
-            host_groups[g["id"]] = g["group_name"]
-        else:
-            detail = api.get_group_detail(g["id"])
-            if isinstance(detail, dict) and "users" in detail:
-                my_info = next((u for u in detail["users"] if u["id"] == me["id"]), None)
-                if my_info and my_info.get("is_host"):
-                    is_host = True
-                    host_groups[g["id"]] = g["group_name"]
+    # 2. ホスト権限判定（オーナーも is_host に含まれる）
+    host_groups = {g["id"]: g["group_name"] for g in my_groups if g.get("is_host")}
+    is_host = bool(host_groups)
+    group_names = {g["id"]: g["group_name"] for g in my_groups}
 
     # ----------------------------------
     # 3. 役割に応じてタブの中身を完全に分ける
@@ -50,43 +43,27 @@ def page_quests():
     all_pending = [] 
     all_done = [] 
 
-    for g in my_groups:
-        detail = api.get_group_detail(g["id"])
-        quest_lookup = {q["id"]: q for q in detail["quests"]} if detail and "quests" in detail else {}
-        my_history = api.get_my_submissions(g["id"])
-        status_map = {}
-        
-        if isinstance(my_history, list):
-            for log in my_history:
-                q_id = log.get("quest_id")
-                status = log.get("status")
-                status_map[q_id] = status 
-                
-                current_q = quest_lookup.get(q_id)
-                q_title = current_q.get("quest_name") if current_q else (log.get("quest_title") or "クエスト")
-                q_reward = current_q.get("reward_points") if current_q else (log.get("reward_points") or 0)
-                
-                info = {"group_name": g["group_name"], "quest_title": str(q_title), "reward": q_reward, "date": log.get("completed_at", "")}
-
-                if status == "approved":
-                    all_done.append(info)
-                elif status == "pending":
-                    all_pending.append(info)
-
-        if detail and "quests" in detail:
-            now = dt.now()
-            for q in detail["quests"]:
-                # 子供の場合、承認待ちや完了済みは挑戦中から消す
-                if not is_host and status_map.get(q["id"]) in ["approved", "pending"]:
-                    continue
-                
-                s_t, e_t = q.get("start_time"), q.get("end_time")
-                try:
-                    s_time = dt.fromisoformat(s_t) if s_t else None
-                    e_time = dt.fromisoformat(e_t) if e_t else None
-                except: continue
-                if (s_time is None or s_time <= now) and (e_time is None or e_time >= now):
-                    all_todo.append({"group_name": g["group_name"], "q": q, "gid": g["id"]})
+    status_map = {}
+    for log in board.get("my_submissions", []):
+        status = log.get("status")
+        status_map[log.get("quest_id")] = status
+        info = {
+            "group_name": group_names.get(log.get("group_id"), ""),
+            "quest_title": str(log.get("quest_title") or "クエスト"),
+            "reward": log.get("reward_points") or 0,
+            "date": log.get("completed_at") or ""
+        }
+        if status == "approved":
+            all_done.append(info)
+        elif status == "pending":
+            all_pending.append(info)
+
+    # 公開期間の絞り込みはバックエンド側で済んでいる
+    for q in board.get("active_quests", []):
+        # 子供の場合、承認待ちや完了済みは挑戦中から消す
+        if not is_host and status_map.get(q["id"]) in ["approved", "pending"]:
+            continue
+        all_todo.append({"group_name": group_names.get(q["group_id"], ""), "q": q, "gid": q["group_id"]})
 
     # --- タブ[0]: クエストに挑戦 (共通) ---
     with tabs[0]:
@@ -147,20 +124,16 @@ def page_quests():
         # ----------------------------------
         with tabs[1]:
             st.subheader("承認待ち一覧")
-            has_p = False
-            for gid, gname in host_groups.items():
-                subs = api.get_pending_submissions(gid)
-                if isinstance(subs, list) and subs:
-                    has_p = True
-                    for sub in subs:
-                        with st.container(border=True):
-                            ca, cb = st.columns([3, 1])
-                            ca.write(f"👤 **{sub.get('user_name')}** → **{sub.get('quest_title')}**")
-                            if cb.button("確認する", key=f"chk_sub_{sub['id']}", type="primary"):
-                                st.session_state.review_target_log = sub
-                                st.session_state.current_page = "quest_review"
-                                st.rerun()
-            if not has_p: st.info("承認待ちの報告はありません。")
+            subs = board.get("pending_reviews", [])
+            for sub in subs:
+                with st.container(border=True):
+                    ca, cb = st.columns([3, 1])
+                    ca.write(f"👤 **{sub.get('user_name')}** → **{sub.get('quest_title')}**")
+                    if cb.button("確認する", key=f"chk_sub_{sub['id']}", type="primary"):
+                        st.session_state.review_target_log = sub
+                        st.session_state.current_page = "quest_review"
+                        st.rerun()
+            if not subs: st.info("承認待ちの報告はありません。")
 
         with tabs[2]:
             st.subheader("クエスト作成")
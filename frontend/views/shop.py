@@ -1,24 +1,18 @@
 import time
 import streamlit as st
 import utils
+import assets
 
 def page_shop():
-    # --- 🖼️ 背景画像の設定 (shop.png を使用) ---
-    bg_img_path = "static/images/shop.png" 
-    try:
-        with open(bg_img_path, "rb") as f:
-            data = f.read()
-            bin_str = base64.b64encode(data).decode()
-        bg_css = f'url("data:image/png;base64,{bin_str}")'
-    except:
-        bg_css = "#3e2723" # 画像がない場合の予備色
+    # --- 🖼️ 背景画像の設定 (shop.png を使用。画像がない場合は予備色) ---
+    bg_rules = assets.background_rules('[data-testid="stAppViewContainer"]', "shop.png", fallback="#3e2723")
 
     # === 🌟 ファンタジーCSS注入 ===
     st.markdown(f"""
     <style>
         /* 全体背景: 商店街の画像を表示 */
+        {bg_rules}
         [data-testid="stAppViewContainer"] {{
-            background-image: {bg_css};
             background-size: cover;
             background-position: center;
             background-attachment: fixed;
@@ -121,18 +115,14 @@ def page_shop():
 
     st.markdown('<div class="main-title"><h1>🛍️ ショップ</h1></div>', unsafe_allow_html=True)
     
-    # --- 🌟 セッション管理 ---
-    if "local_bought" not in st.session_state:
-        st.session_state.local_bought = {}
-    
     api = st.session_state.api
-    me = api.get_me()
-    
-    if "error" in me:
-        st.error("ログイン情報を取得できませんでした")
+    # 残高・商品・残り購入回数・自分の購入履歴を全グループ分まとめて取得
+    overview = api.get_shop_overview()
+    if "error" in overview:
+        st.error("ショップの情報を取得できませんでした")
         return
 
-    my_groups = api.get_my_groups(me["id"])
+    my_groups = overview.get("groups", [])
     if not my_groups:
         st.info("まだどのグループにも所属していないようです。")
         if st.button("🏠 広場に戻る"):
@@ -140,47 +130,19 @@ def page_shop():
             st.rerun()
         return
 
-    # --- 🌟 便利関数 ---
-    def format_time(iso_str):
-        if not iso_str: return "日時不明"
-        try:
-            parsed = dt.fromisoformat(str(iso_str).replace('Z', '+00:00'))
-            return parsed.strftime("%Y/%m/%d %H:%M")
-        except:
-            return str(iso_str)[:16].replace('T', ' ')
-
-    # --- 自分の全購入履歴を取得 ---
-    all_my_purchases = []
-    try:
-        res_my = api.get_my_purchases()
-        if isinstance(res_my, list): all_my_purchases = res_my
-        elif isinstance(res_my, dict):
-            for key in ["purchases", "data", "items", "history"]:
-                if key in res_my and isinstance(res_my[key], list):
-                    all_my_purchases = res_my[key]
-                    break
-    except: pass
+    # ホストとして管理しているグループのみんなの購入記録 (最新ページ) はまとめて並列に取得
+    host_group_ids = [g["id"] for g in my_groups if g["is_host"]]
+    host_histories = dict(zip(host_group_ids, api.fan_out(api.get_purchase_history, host_group_ids)))
 
     # グループごとのタブを作成
     group_names = [f"🏰 {g['group_name']}" for g in my_groups]
     group_tabs = st.tabs(group_names)
 
-    for idx, group_info in enumerate(my_groups):
+    for idx, group in enumerate(my_groups):
         with group_tabs[idx]:
-            group_id = group_info["id"]
-            group = api.get_group_detail(group_id)
-            
-            if "error" in group:
-                st.error(f"グループの情報を読み込めませんでした。")
-                continue
-
-            my_member_info = next((m for m in group["users"] if m["id"] == me["id"]), None)
-            if not my_member_info:
-                st.warning("メンバー登録が確認できませんでした。")
-                continue
-
-            my_points = my_member_info["points"]
-            is_host = my_member_info.get("is_host", False) or (group["owner_user_id"] == me["id"])
+            group_id = group["id"]
+            my_points = group["points"]
+            is_host = group["is_host"]
 
             # 💰 所持ポイント表示
             st.markdown(f"""
@@ -190,25 +152,6 @@ def page_shop():
             </div>
             """, unsafe_allow_html=True)
 
-            # --- 履歴のカウントロジック ---
-            group_history = []
-            try:
-                res_gh = api.get_purchase_history(group_id)
-                if isinstance(res_gh, list): group_history = res_gh
-                elif isinstance(res_gh, dict):
-                    for key in ["purchases", "data", "items", "history"]:
-                        if key in res_gh and isinstance(res_gh[key], list):
-                            group_history = res_gh[key]
-                            break
-            except: pass
-
-            purchase_counts_by_name = {}
-            # 自分の購入分をカウント
-            my_h = [h for h in group_history if h.get("user_id") == me["id"]] if group_history else all_my_purchases
-            for h in my_h:
-                name = h.get('item_name')
-                if name: purchase_counts_by_name[name] = purchase_counts_by_name.get(name, 0) + 1
-
             # --- ギルド内メニュー（サブタブ） ---
             sub_titles = ["🛒 お買い物", "📜 履歴"]
             if is_host: sub_titles = ["🛒 お買い物", "🆕 入荷", "🛠️ 管理", "📜 全履歴"]
@@ -216,7 +159,7 @@ def page_shop():
 
             # --- [サブタブ0] お買い物 ---
             with sub_tabs[0]:
-                items = group.get("shops", [])
+                items = group.get("items", [])
                 if not items:
                     st.info("📦 現在、このグループの棚には商品が並んでいないようです。")
                 else:
@@ -224,10 +167,10 @@ def page_shop():
                     cols = st.columns(2)
                     for i, item in enumerate(items):
                         with cols[i % 2]:
-                            limit = item.get('limit_per_user')
-                            bought_count = max(purchase_counts_by_name.get(item['item_name'], 0), st.session_state.local_bought.get(item['id'], 0))
-                            is_limit_reached = limit is not None and limit > 0 and bought_count >= limit
-                            limit_text = f" (残り {max(0, limit - bought_count)} 回)" if limit else ""
+                            # 残り購入回数はバックエンドで計算済み (上限なしは None)
+                            remaining = item.get('remaining_purchases')
+                            is_limit_reached = remaining is not None and remaining <= 0
+                            limit_text = f" (残り {remaining} 回)" if remaining is not None else ""
                             
                             st.markdown(f"""
                             <div class="item-card">
@@ -255,7 +198,6 @@ def page_shop():
                                     res = api.purchase_item(item['id'])
                                     if "error" in res: st.error(res["error"])
                                     else:
-                                        st.session_state.local_bought[item['id']] = bought_count + 1
                                         st.balloons()
                                         st.success(f"「{item['item_name']}」を購入！ホストに見せてね！")
                                         time.sleep(1.5); st.rerun()
@@ -300,6 +242,9 @@ def page_shop():
                                 
                 with sub_tabs[3]:
                     st.subheader("📜 みんなの購入記録")
+                    # メンバー全員分の履歴はホストのときだけ取得する (最新ページのみ)
+                    history_res = host_histories.get(group_id, {})
+                    group_history = history_res.get("items", []) if "error" not in history_res else []
                     if not group_history:
                         st.info("まだ誰もアイテムを購入していません。")
                     else:
@@ -316,12 +261,13 @@ def page_shop():
             else:
                 # --- 子供専用タブ ---
                 with sub_tabs[1]:
-                    st.subheader("📜 みんなの購入記録")
+                    st.subheader("📜 自分の購入記録")
                     st.info("💡 買ったものは、この画面をホストに見せて交換してもらおう！")
-                    if not group_history:
-                        st.info("まだ誰もアイテムを購入していません。")
+                    my_history = group.get("recent_purchases", [])
+                    if not my_history:
+                        st.info("まだアイテムを購入していません。")
                     else:
-                        for h in group_history:
+                        for h in my_history:
                             with st.container(border=True):
                                 user_name = h.get('user_name') or h.get('username') or 'メンバー'
                                 item_name = h.get('item_name') or 'アイテム'
@@ -1,20 +1,11 @@
 import time
 import streamlit as st
-import base64  # 背景画像を読み込むために必要
+import assets
 
 def page_shop_detail():
-    # --- 🖼️ 背景画像の設定 (Base64変換) ---
-    # shop.png を読み込んで、CSSで背景に設定します
-    bg_img_path = "static/images/shop.png" 
-    
-    try:
-        with open(bg_img_path, "rb") as f:
-            data = f.read()
-            bin_str = base64.b64encode(data).decode()
-        bg_css = f'url("data:image/png;base64,{bin_str}")'
-    except:
-        # 画像がない場合の予備（落ち着いたダークブラウン）
-        bg_css = "#3e2723"
+    # --- 🖼️ 背景画像の設定 ---
+    # shop.png のリサイズ済み WebP を CSS で背景に設定します（画像がない場合は落ち着いたダークブラウン）
+    bg_rules = assets.background_rules('[data-testid="stAppViewContainer"]', "shop.png", fallback="#3e2723")
 
     # ==========================================
     # 💻 [修正] カスタムCSS
@@ -23,8 +14,8 @@ def page_shop_detail():
     st.markdown(f"""
     <style>
         /* 画面全体の背景 */
+        {bg_rules}
         [data-testid="stAppViewContainer"] {{
-            background-image: {bg_css};
             background-size: cover;
             background-position: center;
             background-attachment: fixed; /* スクロールしても背景は固定 */
@@ -166,9 +157,8 @@ def page_shop_detail():
             st.rerun()
         return
 
-    # グループ詳細を取得
-    group = api.get_group_detail(group_id)
-    me = api.get_me()
+    # グループ詳細と自分の情報を並列に取得
+    group, me = api.gather(lambda: api.get_group_detail(group_id), api.get_me)
 
     if "error" in group or "error" in me:
         st.error("データの取得に失敗しました")